@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -40,11 +41,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recipes.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'recipes.replicas.ReplicaMiddleware',
+    'recipes.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,6 +87,31 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database: DB_REPLICAS lists their hosts
+# separated by commas (database files for SQLite). Safe-method requests
+# read from a replica until they write, a user who wrote something reads
+# from the primary for REPLICA_PIN_SECONDS (pins are kept in the
+# REPLICA_PIN_CACHE cache shared by all workers), a replica that refused
+# a connection is skipped for REPLICA_RETRY_SECONDS
+
+DATABASE_REPLICAS = []
+replica_key = 'NAME' if 'sqlite3' in DATABASES['default']['ENGINE'] else 'HOST'
+for number, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', default='').split(',')), 1
+):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        replica_key: replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['recipes.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', default=10))
+REPLICA_RETRY_SECONDS = 30
+REPLICA_PIN_CACHE = 'replica_pins'
+
 # # sqlite3
 # DATABASES = {
 #     'default': {
@@ -159,3 +188,99 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Shopping list export
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Shopping lists up to SHOPPING_LIST_CACHE_MAX_SIZE bytes are cached
+# per database, catalog version and cart version in a cache shared by all
+# workers of the host; replica
+# pins live in a table of the primary (created by createcachetable)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'replica_pins': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'replica_pins',
+    },
+    'shopping_lists': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv(
+            'SHOPPING_LIST_CACHE_DIR',
+            default=os.path.join(
+                tempfile.gettempdir(), 'foodgram-shopping-lists'
+            )
+        ),
+    },
+}
+SHOPPING_LIST_CACHE_MAX_SIZE = 256 * 1024
+
+# Ingredient autocomplete
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+# Tags and ingredients cached in every process: seconds between checks
+# of the shared catalog version
+
+CATALOG_CHECK_INTERVAL = 5
+
+# How many recipes POST /api/recipes/bulk/ accepts at once
+
+RECIPE_BULK_CREATE_LIMIT = 100
+
+# How many ids the batch favorite/shopping_cart/subscribe endpoints accept
+
+RELATION_BATCH_LIMIT = 500
+
+# Recipe image renditions: name -> maximum (width, height)
+
+RECIPE_IMAGE_RENDITIONS = {
+    'card': (480, 320),
+    'detail': (1200, 800),
+}
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+
+# Per-request metrics: every worker flushes its histograms into its own
+# file in METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds;
+# /metrics/ is open to staff and to requests with
+# "Authorization: Bearer <METRICS_TOKEN>"
+
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'foodgram-metrics')
+)
+METRICS_FLUSH_INTERVAL = 1
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
+# Profiles of staff requests with the X-Profile header or ?profile=
+
+PROFILE_DIR = os.getenv(
+    'PROFILE_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'foodgram-profiles')
+)
+PROFILE_KEEP = 100
+
+# Subscription timelines: recipes of authors with more followers than
+# TIMELINE_FANOUT_LIMIT are merged in on read instead of being copied
+# to every follower; a new subscription copies the author's latest
+# TIMELINE_BACKFILL recipes; followers of an author who drops back to
+# the limit are backfilled in a background thread after the response
+
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', default=10000))
+TIMELINE_BACKFILL = 100
+TIMELINE_BACKFILL_IN_BACKGROUND = True
+
+# How many similar recipes compute_similar_recipes keeps per recipe
+
+SIMILAR_RECIPES_TOP = 20
+
+# Pantry matching index: each worker picks up changed recipes at most
+# every PANTRY_CHECK_INTERVAL seconds
+
+PANTRY_CHECK_INTERVAL = 5
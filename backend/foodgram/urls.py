@@ -3,9 +3,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from recipes.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('recipes.urls', namespace='recipes')),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -1,6 +1,11 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
 
+from . import cart, counters, images, pantry, timeline
 from .models import Ingredient, IngredientAmount, Recipe, Tag
+from .search import update_search_vectors
+
+User = get_user_model()
 
 admin.site.register(IngredientAmount)
 
@@ -51,7 +56,39 @@ class RecipeAdmin(admin.ModelAdmin):
     ordering = ('author', 'pub_date',)
     empty_value_display = '-'
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            images.schedule(obj)
+
+    def save_related(self, request, form, formsets, change):
+        """Пересчитывает списки покупок, которые задело изменение,
+        и поисковый вектор рецепта."""
+        users = cart.get_cart_users((form.instance.id,))
+        super().save_related(request, form, formsets, change)
+        update_search_vectors((form.instance.id,))
+        cart.rebuild(users | cart.get_cart_users((form.instance.id,)))
+        counters.reconcile(Recipe.objects.filter(id=form.instance.id))
+        counters.reconcile(User.objects.filter(recipes=form.instance))
+        pantry.recipes_changed((form.instance.id,))
+        if not change:
+            timeline.fan_out((form.instance.id,))
+
+    def delete_model(self, request, obj):
+        users = cart.get_cart_users((obj.id,))
+        super().delete_model(request, obj)
+        cart.rebuild(users)
+        counters.reconcile(User.objects.filter(id=obj.author_id))
+
+    def delete_queryset(self, request, queryset):
+        users = cart.get_cart_users(queryset.values('id'))
+        authors = set(queryset.values_list('author', flat=True))
+        super().delete_queryset(request, queryset)
+        cart.rebuild(users)
+        counters.reconcile(User.objects.filter(id__in=authors))
+
     def get_favor_count(self, obj):
         """Счётчик: сколько раз добавили рецепт в избранное."""
-        return obj.favorite.count()
+        return obj.favorites_count
     get_favor_count.short_description = 'в избранном'
+    get_favor_count.admin_order_field = 'favorites_count'
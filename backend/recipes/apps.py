@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from . import catalog, metrics, search, versions  # noqa: F401
+        metrics.instrument_serializers()
@@ -0,0 +1,395 @@
+"""Замеры запросов к базе и времени ответа для маршрутов API.
+
+Данные создаются через mixer в тестовой базе, каждый сценарий — один
+запрос анонима или пользователя к маршруту из recipes/urls.py
+с наибольшим допустимым числом запросов к базе. Каждый запрос
+выполняется в транзакции, которая откатывается, поэтому сценарии
+не влияют друг на друга и их можно повторять.
+"""
+import base64
+import random
+import statistics
+import time
+from collections import namedtuple
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+from mixer.backend.django import mixer
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from . import cart, counters, pantry, timeline
+from .models import Ingredient, IngredientAmount, Recipe, Tag
+from .search import update_search_vectors
+from .similarity import SimilarityBuilder
+from .urls import router_v1
+
+User = get_user_model()
+
+PASSWORD = 'benchmark-password'
+
+
+# Маршруты djoser для писем активации и сброса: в проекте они
+# не настроены (нет ссылок для писем), так что и замерять нечего.
+# Смена username при входе по email в djoser не работает, а профили
+# запросов — отладочные файлы сотрудников, а не часть API.
+SKIPPED_ROUTES = {
+    'profiles-detail',
+    'profiles-download',
+    'profiles-list',
+    'users-set-username',
+    'users-activation',
+    'users-resend-activation',
+    'users-reset-password',
+    'users-reset-password-confirm',
+    'users-reset-username',
+    'users-reset-username-confirm',
+}
+
+# Служебные запросы транзакции, в которой выполняется сценарий.
+TRANSACTION_PREFIXES = (
+    'BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO'
+)
+
+
+def get_caches():
+    """Кэши на время замеров: свои, в памяти процесса, чтобы замеры
+    не читали и не засоряли общие кэши рабочего сервера."""
+    return {
+        alias: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': f'benchmark-{alias}',
+        } for alias in settings.CACHES
+    }
+
+
+Scenario = namedtuple(
+    'Scenario', 'name route method path data user status budget'
+)
+Result = namedtuple('Result', 'scenario status queries timings')
+
+
+class Dataset:
+    """Пользователи, рецепты и связи между ними для замеров."""
+
+    def __init__(self, users=50, recipes=500, seed=1):
+        self.random = random.Random(seed)
+        self.tags = mixer.cycle(6).blend(
+            Tag,
+            name=mixer.sequence('тег {0}'),
+            slug=mixer.sequence('tag{0}'),
+            color=mixer.sequence('#0000{0:02d}'),
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(300)
+        )
+        self.ingredients = list(Ingredient.objects.all())
+        self.users = mixer.cycle(users).blend(
+            User,
+            username=mixer.sequence('user{0}'),
+            email=mixer.sequence('user{0}@example.com'),
+        )
+        self.recipes = mixer.cycle(recipes).blend(
+            Recipe,
+            author=(self.users[number % users] for number in range(recipes)),
+            name=mixer.sequence('рецепт {0}'),
+            text='Суп с курицей и картофелем.',
+            image='recipe/benchmark.png',
+            search_vector=None,
+            cooking_time=(
+                self.random.randint(5, 120) for _ in range(recipes)
+            ),
+        )
+        self.link_recipes()
+        self.link_users()
+        recipe_ids = [recipe.id for recipe in self.recipes]
+        update_search_vectors(recipe_ids)
+        pantry.recipes_changed(recipe_ids)
+        counters.reconcile(Recipe.objects.all())
+        counters.reconcile(User.objects.all())
+        cart.rebuild(user.id for user in self.users)
+        timeline.rebuild(user.id for user in self.users)
+        SimilarityBuilder().run(full=True)
+
+        # Читатель с избранным, корзиной и подписками и автор рецептов.
+        self.reader, self.author = self.users[0], self.users[1]
+        for user in (self.reader, self.author):
+            user.set_password(PASSWORD)
+            user.save(update_fields=('password',))
+        self.tokens = {
+            user.id: Token.objects.create(user=user).key
+            for user in (self.reader, self.author)
+        }
+        self.own_recipe = Recipe.objects.filter(author=self.author).first()
+        self.favorite = Recipe.objects.filter(favorite=self.reader).first()
+        self.not_favorite = Recipe.objects.exclude(
+            favorite=self.reader
+        ).first()
+        self.in_cart = Recipe.objects.filter(cart=self.reader).first()
+        self.not_in_cart = Recipe.objects.exclude(cart=self.reader).first()
+        self.followed = User.objects.filter(subscribes=self.reader).first()
+        self.not_followed = User.objects.exclude(
+            subscribes=self.reader
+        ).exclude(id=self.reader.id).first()
+
+    def link_recipes(self):
+        """Теги и ингредиенты рецептов."""
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+            for recipe in self.recipes
+            for tag in self.random.sample(self.tags, 2)
+        )
+        IngredientAmount.objects.bulk_create(
+            (
+                IngredientAmount(
+                    recipe_id=recipe.id,
+                    ingredients_id=ingredient.id,
+                    amount=self.random.randint(1, 500),
+                )
+                for recipe in self.recipes
+                for ingredient in self.random.sample(self.ingredients, 8)
+            ),
+            batch_size=cart.BATCH_SIZE,
+        )
+
+    def link_users(self):
+        """Избранное, корзины и подписки: у первых пользователей больше."""
+        favorites, carts, subscriptions = [], [], []
+        for number, user in enumerate(self.users):
+            size = max(len(self.recipes) // (number + 2), 1)
+            for recipe in self.random.sample(self.recipes, size):
+                favorites.append(Recipe.favorite.through(
+                    user_id=user.id, recipe_id=recipe.id
+                ))
+            for recipe in self.random.sample(self.recipes, size // 10 + 1):
+                carts.append(Recipe.cart.through(
+                    user_id=user.id, recipe_id=recipe.id
+                ))
+            authors = self.random.sample(
+                self.users, max(len(self.users) // (number + 2), 1)
+            )
+            subscriptions.extend(
+                User.subscribe.through(from_user_id=user.id, to_user_id=a.id)
+                for a in authors if a.id != user.id
+            )
+        for rows in (favorites, carts, subscriptions):
+            type(rows[0]).objects.bulk_create(
+                rows, batch_size=cart.BATCH_SIZE
+            )
+
+    def recipe_data(self, name):
+        return {
+            'name': name,
+            'text': 'Новый рецепт.',
+            'cooking_time': 15,
+            'image': get_image(),
+            'tags': [tag.id for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:5]
+            ],
+        }
+
+
+def get_image():
+    """Картинка для нового рецепта в base64."""
+    data = BytesIO()
+    Image.new('RGB', (64, 64), '#e0a040').save(data, 'PNG')
+    return (
+        'data:image/png;base64,' + base64.b64encode(data.getvalue()).decode()
+    )
+
+
+def get_scenarios(data):
+    """Сценарии замеров; user — None для анонима, иначе пользователь."""
+    tag, ingredient = data.tags[0], data.ingredients[0]
+    recipe, author = data.own_recipe, data.author
+    reader = data.reader
+    recipe_ids = [item.id for item in data.recipes[:20]]
+    author_ids = [item.id for item in data.users[:10]]
+
+    def url(name, *args, query=''):
+        return reverse(f'recipes:{name}', args=args) + query
+
+    scenarios = (
+        ('api-root', 'get', url('api-root'), None, None, 200, 0),
+        ('tags-list', 'get', url('tags-list'), None, None, 200, 1),
+        ('tags-detail', 'get', url('tags-detail', tag.id), None, None,
+         200, 1),
+        ('ingredients-list', 'get', url('ingredients-list'), None, None,
+         200, 1),
+        ('ingredients-list', 'get',
+         url('ingredients-list', query='?name=ингр'), None, None, 200, 1),
+        ('ingredients-detail', 'get', url('ingredients-detail', ingredient.id),
+         None, None, 200, 1),
+        ('recipes-list', 'get', url('recipes-list', query='?limit=6'),
+         None, None, 200, 7),
+        ('recipes-list', 'get', url('recipes-list', query='?limit=30'),
+         None, reader, 200, 9),
+        ('recipes-list', 'get',
+         url('recipes-list', query=f'?tags={tag.slug}&cursor='),
+         None, None, 200, 6),
+        ('recipes-list', 'get', url('recipes-list', query=(
+            f'?tags={data.tags[0].slug}&tags={data.tags[1].slug}'
+            f'&tags_mode=all&ingredients={data.ingredients[0].id}'
+            f'&exclude_ingredients={data.ingredients[1].id}'
+            f'&cooking_time_min=5&cooking_time_max=120&limit=6'
+        )), None, None, 200, 7),
+        ('recipes-list', 'get',
+         url('recipes-list', query='?is_favorited=1&is_in_shopping_cart=1'),
+         None, reader, 200, 8),
+        ('recipes-list', 'get',
+         url('recipes-list', query='?search=суп&ordering=popular&limit=6'),
+         None, None, 200, 7),
+        ('recipes-list', 'post', url('recipes-list'),
+         data.recipe_data('новый рецепт'), author, 201, 16),
+        ('recipes-detail', 'get', url('recipes-detail', recipe.id), None,
+         None, 200, 6),
+        ('recipes-detail', 'get', url('recipes-detail', recipe.id), None,
+         reader, 200, 8),
+        ('recipes-detail', 'patch', url('recipes-detail', recipe.id), {
+            'cooking_time': 99,
+            'tags': [item.id for item in data.tags[:3]],
+            'ingredients': [
+                {'id': item.id, 'amount': 20}
+                for item in data.ingredients[3:9]
+            ],
+        }, author, 200, 20),
+        ('recipes-detail', 'delete', url('recipes-detail', recipe.id), None,
+         author, 204, 16),
+        ('recipes-bulk', 'post', url('recipes-bulk'),
+         [data.recipe_data(f'пачка {number}') for number in range(10)],
+         author, 201, 16),
+        ('recipes-similar', 'get',
+         url('recipes-similar', recipe.id, query='?limit=6'), None, None,
+         200, 1),
+        ('recipes-pantry', 'get', url('recipes-pantry', query=(
+            '?have=' + ','.join(str(item.id) for item in data.ingredients[:8])
+            + '&limit=6'
+        )), None, None, 200, 5),
+        ('recipes-favorite', 'post',
+         url('recipes-favorite', data.not_favorite.id), None, reader, 201, 4),
+        ('recipes-favorite', 'delete',
+         url('recipes-favorite', data.favorite.id), None, reader, 204, 4),
+        ('recipes-shopping-cart', 'post',
+         url('recipes-shopping-cart', data.not_in_cart.id), None, reader,
+         201, 8),
+        ('recipes-shopping-cart', 'delete',
+         url('recipes-shopping-cart', data.in_cart.id), None, reader,
+         204, 8),
+        ('recipes-favorite-batch', 'post', url('recipes-favorite-batch'),
+         {'ids': recipe_ids}, reader, 200, 3),
+        ('recipes-shopping-cart-batch', 'post',
+         url('recipes-shopping-cart-batch'), {'ids': recipe_ids}, reader,
+         200, 7),
+        ('recipes-shopping-cart-batch', 'delete',
+         url('recipes-shopping-cart-batch'), {'ids': recipe_ids}, reader,
+         200, 7),
+        ('recipes-feed', 'get', url('recipes-feed', query='?limit=10'),
+         None, reader, 200, 7),
+        ('recipes-download-shopping-cart', 'get',
+         url('recipes-download-shopping-cart'), None, reader, 200, 2),
+        ('users-list', 'get', url('users-list'), None, None, 200, 1),
+        ('users-list', 'get', url('users-list'), None, reader, 200, 2),
+        ('users-list', 'post', url('users-list'), {
+            'username': 'newcomer', 'email': 'newcomer@example.com',
+            'first_name': 'Новый', 'last_name': 'Пользователь',
+            'password': PASSWORD,
+        }, None, 201, 3),
+        ('users-detail', 'get', url('users-detail', author.id), None, reader,
+         200, 2),
+        ('users-me', 'get', url('users-me'), None, reader, 200, 1),
+        ('users-subscribe', 'post',
+         url('users-subscribe', data.not_followed.id), None, reader, 201, 6),
+        ('users-subscribe', 'delete',
+         url('users-subscribe', data.followed.id), None, reader, 204, 6),
+        ('users-subscribe-batch', 'post', url('users-subscribe-batch'),
+         {'ids': author_ids}, reader, 200, 4),
+        ('users-subscriptions', 'get',
+         url('users-subscriptions', query='?recipes_limit=3'), None, reader,
+         200, 3),
+        ('users-set-password', 'post', url('users-set-password'),
+         {'current_password': PASSWORD, 'new_password': PASSWORD + '1'},
+         reader, 204, 2),
+        ('login', 'post', url('login'),
+         {'email': reader.email, 'password': PASSWORD}, None, 200, 4),
+        ('logout', 'post', url('logout'), None, reader, 204, 2),
+    )
+    return [
+        Scenario(
+            f'{method.upper()} {path} '
+            f'({"anonymous" if user is None else user.username})',
+            route, method, path, body, user, status, budget,
+        )
+        for route, method, path, body, user, status, budget in scenarios
+    ]
+
+
+def get_routes():
+    """Имена маршрутов из recipes/urls.py, которые нужно замерить."""
+    from djoser.urls.authtoken import urlpatterns
+    names = {pattern.name for pattern in router_v1.urls}
+    names.update(pattern.name for pattern in urlpatterns)
+    return names - SKIPPED_ROUTES
+
+
+class QueryCounter:
+    """Считает запросы к базе, кроме служебных запросов транзакций."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.startswith(TRANSACTION_PREFIXES):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def request(data, scenario):
+    """Выполняет запрос сценария и откатывает его изменения."""
+    headers = {}
+    if scenario.user is not None:
+        headers['HTTP_AUTHORIZATION'] = (
+            f'Token {data.tokens[scenario.user.id]}'
+        )
+    method = getattr(Client(), scenario.method)
+    with transaction.atomic():
+        if scenario.data is None:
+            response = method(scenario.path, **headers)
+        else:
+            response = method(
+                scenario.path, scenario.data,
+                content_type='application/json', **headers
+            )
+        if response.streaming:
+            b''.join(response.streaming_content)
+        transaction.set_rollback(True)
+    return response
+
+
+def measure(data, scenario, repeat):
+    """Число запросов к базе и время ответа в миллисекундах.
+
+    Первый запрос не считается: он прогревает кеши процесса.
+    """
+    request(data, scenario)
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        response = request(data, scenario)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        request(data, scenario)
+        timings.append((time.perf_counter() - started) * 1000)
+    return Result(
+        scenario, response.status_code, counter.count, timings
+    )
+
+
+def median(result):
+    return statistics.median(result.timings)
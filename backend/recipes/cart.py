@@ -0,0 +1,131 @@
+"""Агрегированный список покупок пользователей.
+
+Суммы ингредиентов хранятся в CartIngredient и меняются на разницу
+при добавлении/удалении рецептов из корзины и при изменении рецептов,
+которые уже лежат в чьей-то корзине.
+"""
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F, Sum
+
+from .models import CartIngredient, IngredientAmount, Recipe
+
+User = get_user_model()
+
+# Сколько строк вставлять одним запросом.
+BATCH_SIZE = 500
+
+
+def get_recipe_amounts(recipe_ids):
+    """Суммы ингредиентов рецептов в виде {id ингредиента: количество}."""
+    return dict(
+        IngredientAmount.objects.filter(
+            recipe__in=recipe_ids
+        ).values_list('ingredients').annotate(Sum('amount')).order_by()
+    )
+
+
+def get_cart_users(recipe_ids):
+    """id пользователей, у которых рецепты лежат в корзине."""
+    return set(
+        Recipe.cart.through.objects.filter(
+            recipe__in=recipe_ids
+        ).values_list('user', flat=True)
+    )
+
+
+def bump_versions(user_ids):
+    User.objects.filter(
+        id__in=user_ids
+    ).update(cart_version=F('cart_version') + 1)
+
+
+def apply_changes(user_ids, changes):
+    """Прибавляет изменения {id ингредиента: разница} к спискам покупок."""
+    user_ids = list(user_ids)
+    changes = {key: value for key, value in changes.items() if value}
+    if not user_ids or not changes:
+        return
+
+    table = connection.ops.quote_name(CartIngredient._meta.db_table)
+    user_column = CartIngredient._meta.get_field('user').column
+    ingredient_column = CartIngredient._meta.get_field('ingredient').column
+    rows = [
+        (user_id, ingredient_id, amount)
+        for user_id in user_ids
+        for ingredient_id, amount in changes.items()
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} '
+                f'({user_column}, {ingredient_column}, amount) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({user_column}, {ingredient_column}) '
+                f'DO UPDATE SET amount = {table}.amount + EXCLUDED.amount',
+                [value for row in batch for value in row]
+            )
+        CartIngredient.objects.filter(
+            user__in=user_ids, amount__lte=0
+        ).delete()
+        bump_versions(user_ids)
+
+
+def add_recipes(user, recipe_ids):
+    """Добавляет ингредиенты рецептов в список покупок пользователя."""
+    apply_changes((user.id,), get_recipe_amounts(recipe_ids))
+
+
+def remove_recipes(user, recipe_ids):
+    """Убирает ингредиенты рецептов из списка покупок пользователя."""
+    apply_changes(
+        (user.id,),
+        {
+            ingredient: -amount
+            for ingredient, amount in get_recipe_amounts(recipe_ids).items()
+        }
+    )
+
+
+def recipe_changed(recipe_id, old_amounts, user_ids=None):
+    """Переносит изменение ингредиентов рецепта в списки покупок.
+
+    old_amounts — суммы ингредиентов рецепта до изменения, user_ids —
+    владельцы корзин, если рецепт уже удалён вместе со связями.
+    """
+    if user_ids is None:
+        user_ids = get_cart_users((recipe_id,))
+    new_amounts = get_recipe_amounts((recipe_id,))
+    apply_changes(
+        user_ids,
+        {
+            ingredient: (
+                new_amounts.get(ingredient, 0) - old_amounts.get(ingredient, 0)
+            )
+            for ingredient in set(new_amounts) | set(old_amounts)
+        }
+    )
+
+
+def rebuild(user_ids):
+    """Пересчитывает списки покупок пользователей с нуля."""
+    user_ids = list(user_ids)
+    totals = IngredientAmount.objects.filter(
+        recipe__cart__in=user_ids
+    ).values(
+        'ingredients', user=F('recipe__cart')
+    ).annotate(total=Sum('amount')).order_by()
+    with transaction.atomic():
+        CartIngredient.objects.filter(user__in=user_ids).delete()
+        CartIngredient.objects.bulk_create(
+            (
+                CartIngredient(
+                    user_id=row['user'],
+                    ingredient_id=row['ingredients'],
+                    amount=row['total'],
+                ) for row in totals
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        bump_versions(user_ids)
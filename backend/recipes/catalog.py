@@ -0,0 +1,96 @@
+"""Теги и ингредиенты в памяти процесса.
+
+Каталог загружается из базы при первом обращении и перечитывается,
+когда меняется его версия (versions.CATALOG). Версия проверяется
+не чаще раза в settings.CATALOG_CHECK_INTERVAL секунд, так что правка
+в админке или загрузка из файла доходят до всех воркеров gunicorn
+за это время, а в процессе, где правка сделана, — сразу.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import serializers, versions
+from .models import Ingredient, Tag
+
+
+class Catalog:
+    """Снимок тегов и ингредиентов одной версии."""
+
+    def __init__(self, version, updated_at=None):
+        self.version = version
+        self.updated_at = updated_at
+        self.tags = list(Tag.objects.all())
+        self.ingredients = list(Ingredient.objects.all())
+        self.tags_by_id = {tag.id: tag for tag in self.tags}
+        self.tag_ids_by_slug = {tag.slug: tag.id for tag in self.tags}
+        self.ingredients_by_id = {
+            ingredient.id: ingredient for ingredient in self.ingredients
+        }
+        self.data = {
+            'tags': serializers.TagSerializer(self.tags, many=True).data,
+            'ingredients': serializers.IngredientSerializer(
+                self.ingredients, many=True
+            ).data,
+        }
+        self.data_by_id = {
+            name: {item['id']: item for item in items}
+            for name, items in self.data.items()
+        }
+
+
+class CatalogHolder:
+    """Хранит каталог и перечитывает его при смене версии."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.catalog = None
+        self.checked_at = 0
+
+    def get(self):
+        interval = settings.CATALOG_CHECK_INTERVAL
+        with self.lock:
+            if self.catalog is not None and (
+                time.monotonic() - self.checked_at < interval
+            ):
+                return self.catalog
+            version, updated_at = versions.get()
+            if self.catalog is None or self.catalog.version != version:
+                self.catalog = Catalog(version, updated_at)
+            self.checked_at = time.monotonic()
+            return self.catalog
+
+    def invalidate(self):
+        with self.lock:
+            self.catalog = None
+
+
+holder = CatalogHolder()
+
+
+def get():
+    return holder.get()
+
+
+def resolve(model, ids):
+    """Теги или ингредиенты по id: из памяти, недостающие — одним запросом.
+
+    Запрос нужен, только если объект появился позже, чем процесс
+    последний раз проверял версию каталога.
+    """
+    current = get()
+    known = current.tags_by_id if model is Tag else current.ingredients_by_id
+    found = {pk: known[pk] for pk in ids if pk in known}
+    missing = set(ids) - set(found)
+    if missing:
+        found.update(model.objects.in_bulk(missing))
+    return found
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_catalog(**kwargs):
+    holder.invalidate()
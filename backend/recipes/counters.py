@@ -0,0 +1,67 @@
+"""Счётчики избранного, списков покупок, рецептов и подписчиков.
+
+Счётчики хранятся в Recipe и User и меняются атомарно через F(),
+а пересчитать их заново можно командой reconcile_counters.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Recipe
+
+User = get_user_model()
+
+# Какой счётчик меняется при добавлении связи из AddRemoveMixin.
+RELATION_COUNTERS = {
+    'favorite': (Recipe, 'favorites_count'),
+    'shopping_cart': (Recipe, 'carts_count'),
+    'subscribe': (User, 'followers_count'),
+}
+
+
+def change(model, ids, field, delta):
+    """Меняет счётчик на delta, не опуская его ниже нуля."""
+    model.objects.filter(id__in=ids).update(
+        **{field: Greatest(F(field) + delta, Value(0))}
+    )
+
+
+def relation_changed(relation, ids, delta):
+    """Меняет счётчик объектов, которые добавили в связь или убрали."""
+    model, field = RELATION_COUNTERS[relation]
+    change(model, ids, field, delta)
+
+
+def count_rows(queryset, field):
+    """Подзапрос с количеством строк queryset, ссылающихся на объект."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                count=Count('*')
+            ).values('count')
+        ),
+        0
+    )
+
+
+def get_recounts(model):
+    if model is Recipe:
+        return {
+            'favorites_count': count_rows(
+                Recipe.favorite.through.objects, 'recipe'
+            ),
+            'carts_count': count_rows(Recipe.cart.through.objects, 'recipe'),
+        }
+    return {
+        'recipes_count': count_rows(Recipe.objects, 'author'),
+        'followers_count': count_rows(
+            User.subscribe.through.objects, 'to_user'
+        ),
+    }
+
+
+def reconcile(queryset):
+    """Пересчитывает счётчики объектов queryset (рецептов или юзеров)."""
+    return queryset.update(**get_recounts(queryset.model))
@@ -0,0 +1,339 @@
+"""Синтетические данные для нагрузочных тестов и планирования мощностей.
+
+Теги и ингредиенты берутся из data/*.csv, пользователи, рецепты,
+избранное, списки покупок и подписки генерируются. Популярность рецептов,
+авторов и ингредиентов распределена по закону Ципфа, а активность
+пользователей — по Парето: немногие пользователи добавляют в избранное
+сотни рецептов, немногие авторы собирают большинство подписчиков.
+При одинаковом seed и одинаковой исходной базе данные совпадают.
+
+Строки пишутся пачками без создания моделей: в Postgres через COPY,
+в остальных базах через executemany, каждая пачка — в своей транзакции.
+"""
+import bisect
+import csv
+import io
+import itertools
+import os
+import random
+import time
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import cart, pantry, versions
+from .importers import IngredientImporter, TagImporter, batched, read_csv
+from .models import Ingredient, IngredientAmount, Recipe, Tag
+from .relations import RELATIONS
+from .search import update_search_vectors
+
+User = get_user_model()
+
+CATALOGS = (
+    (TagImporter, os.path.join(settings.BASE_DIR, 'data/tags.csv')),
+    (
+        IngredientImporter,
+        os.path.join(settings.BASE_DIR, 'data/ingredients.csv'),
+    ),
+)
+
+# Чем меньше, тем сильнее разброс активности пользователей.
+ACTIVITY_ALPHA = 1.5
+
+DISHES = (
+    'Суп', 'Салат', 'Рагу', 'Запеканка', 'Паста', 'Пирог', 'Каша',
+    'Омлет', 'Плов', 'Котлеты', 'Соус', 'Смузи',
+)
+WORDS = (
+    'нарезать', 'обжарить', 'добавить', 'посолить', 'тушить', 'варить',
+    'минут', 'огне', 'сковороде', 'кастрюле', 'подавать', 'горячим',
+    'перемешать', 'остудить', 'духовке', 'до', 'готовности', 'мелко',
+)
+
+
+class ZipfSampler:
+    """Случайные элементы items: k-й по популярности выпадает
+    с весом 1 / k ** exponent.
+
+    Элементы перед этим перемешиваются, чтобы популярность
+    не совпадала с порядком id.
+    """
+
+    def __init__(self, items, exponent, rng):
+        self.items = array('q', items)
+        rng.shuffle(self.items)
+        self.random = rng.random
+        self.cum_weights = array('d', itertools.accumulate(
+            1 / (rank + 1) ** exponent for rank in range(len(self.items))
+        ))
+        self.total = self.cum_weights[-1] if self.cum_weights else 0
+
+    def sample(self):
+        return self.items[
+            bisect.bisect(self.cum_weights, self.random() * self.total)
+        ]
+
+    def sample_distinct(self, count):
+        """До count разных элементов; редкие хвосты могут не набраться."""
+        count = min(count, len(self.items))
+        found = set()
+        for _ in range(count * 10):
+            if len(found) >= count:
+                break
+            found.add(self.sample())
+        return found
+
+
+class RowWriter:
+    """Пачечная запись строк в таблицу модели в обход ORM."""
+
+    def __init__(self, use_copy):
+        self.use_copy = use_copy
+
+    def get_defaults(self, model, fields):
+        """Значения по умолчанию для остальных полей модели."""
+        defaults = {}
+        for field in model._meta.concrete_fields:
+            if field.primary_key or field.name in fields:
+                continue
+            value = field.get_db_prep_save(field.get_default(), connection)
+            if value is None and not field.null:
+                raise ValueError(f'{model.__name__}.{field.name} не задано')
+            defaults[field.column] = value
+        return defaults
+
+    def write(self, model, fields, rows):
+        """Пишет строки со значениями fields, возвращает их число."""
+        rows = list(rows)
+        if not rows:
+            return 0
+        defaults = self.get_defaults(model, fields)
+        columns = [model._meta.get_field(name).column for name in fields]
+        columns.extend(defaults)
+        rows = [(*row, *defaults.values()) for row in rows]
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        column_list = ', '.join(quote(column) for column in columns)
+        with transaction.atomic(), connection.cursor() as cursor:
+            if self.use_copy:
+                data = io.StringIO()
+                csv.writer(data).writerows(
+                    [r'\N' if value is None else value for value in row]
+                    for row in rows
+                )
+                data.seek(0)
+                cursor.copy_expert(
+                    f'COPY {table} ({column_list}) FROM STDIN '
+                    f"WITH (FORMAT csv, NULL '\\N')",
+                    data
+                )
+            else:
+                cursor.executemany(
+                    f'INSERT INTO {table} ({column_list}) VALUES '
+                    f'({", ".join(["%s"] * len(columns))})',
+                    rows
+                )
+        return len(rows)
+
+
+class DatasetGenerator:
+    """Генерация пользователей, рецептов и связей между ними."""
+
+    def __init__(self, users, recipes, favorites=20, carts=3,
+                 subscriptions=10, exponent=1.1, seed=1, batch_size=10000,
+                 prefix='generated', use_copy=False, report=None):
+        self.users = users
+        self.recipes = recipes
+        self.favorites = favorites
+        self.carts = carts
+        self.subscriptions = subscriptions
+        self.exponent = exponent
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.writer = RowWriter(use_copy)
+        self.report = report or (lambda *args: None)
+        self.user_ids = self.recipe_ids = None
+
+    def run(self):
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise ValueError(
+                f'Пользователи {self.prefix}* уже есть, нужен другой prefix'
+            )
+        self.load_catalog()
+        self.generate_users()
+        self.generate_recipes()
+        self.generate_relation(
+            'favorite', self.recipe_sampler, self.favorites
+        )
+        self.generate_relation(
+            'shopping_cart', self.recipe_sampler, self.carts
+        )
+        self.generate_relation(
+            'subscribe', self.author_sampler, self.subscriptions
+        )
+        self.finish()
+
+    def write(self, name, model, fields, rows):
+        """Пишет поток строк пачками и сообщает о скорости."""
+        started = time.monotonic()
+        written = 0
+        for batch in batched(rows, self.batch_size):
+            written += self.writer.write(model, fields, batch)
+            self.report(name, written, time.monotonic() - started)
+        return written
+
+    def get_new_ids(self, model, last_id):
+        return array('q', model.objects.filter(
+            id__gt=last_id
+        ).order_by('id').values_list('id', flat=True).iterator())
+
+    def load_catalog(self):
+        """Теги и ингредиенты из data/*.csv, уже загруженные пропускаются."""
+        for importer_class, path in CATALOGS:
+            importer = importer_class()
+            with open(path, encoding='utf-8') as file:
+                for batch in batched(read_csv(file), self.batch_size):
+                    importer.import_batch(batch)
+        self.tag_ids = list(Tag.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        ingredients = list(Ingredient.objects.order_by('id').values_list(
+            'id', 'name'
+        ))
+        self.ingredient_names = dict(ingredients)
+        self.ingredient_sampler = ZipfSampler(
+            self.ingredient_names, self.exponent, self.random
+        )
+
+    def generate_users(self):
+        last_id = User.objects.aggregate(last=Max('id'))['last'] or 0
+        password = make_password(None)
+        joined = connection.ops.adapt_datetimefield_value(timezone.now())
+        self.write('users', User, (
+            'username', 'email', 'first_name', 'last_name', 'password',
+            'date_joined',
+        ), (
+            (
+                f'{self.prefix}{number}',
+                f'{self.prefix}{number}@example.com',
+                f'Имя {number}',
+                f'Фамилия {number}',
+                password,
+                joined,
+            ) for number in range(self.users)
+        ))
+        self.user_ids = self.get_new_ids(User, last_id)
+        self.author_sampler = ZipfSampler(
+            self.user_ids, self.exponent, self.random
+        )
+
+    def get_recipe_rows(self):
+        now = timezone.now()
+        period = timedelta(days=365)
+        adapt = connection.ops.adapt_datetimefield_value
+        for number in range(self.recipes):
+            pub_date = adapt(
+                now - period + period * number / max(self.recipes, 1)
+            )
+            ingredient = self.ingredient_names[
+                self.ingredient_sampler.sample()
+            ]
+            yield (
+                self.author_sampler.sample(),
+                f'{self.random.choice(DISHES)}: {ingredient} {number}',
+                ' '.join(self.random.choices(WORDS, k=30)),
+                self.random.randint(5, 180),
+                pub_date,
+                pub_date,
+            )
+
+    def get_composition_rows(self):
+        """Теги и количество ингредиентов каждого рецепта."""
+        for recipe_id in self.recipe_ids:
+            tags = self.random.sample(
+                self.tag_ids, min(self.random.randint(1, 3), len(self.tag_ids))
+            )
+            ingredients = self.ingredient_sampler.sample_distinct(
+                self.random.randint(3, 12)
+            )
+            yield (
+                [(recipe_id, tag_id) for tag_id in tags],
+                [
+                    (recipe_id, ingredient_id, self.random.randint(1, 500))
+                    for ingredient_id in ingredients
+                ],
+            )
+
+    def generate_recipes(self):
+        last_id = Recipe.objects.aggregate(last=Max('id'))['last'] or 0
+        self.write('recipes', Recipe, (
+            'author', 'name', 'text', 'cooking_time', 'pub_date',
+            'updated_at',
+        ), self.get_recipe_rows())
+        self.recipe_ids = self.get_new_ids(Recipe, last_id)
+        self.recipe_sampler = ZipfSampler(
+            self.recipe_ids, self.exponent, self.random
+        )
+
+        started = time.monotonic()
+        written = 0
+        for batch in batched(
+            self.get_composition_rows(), self.batch_size // 10
+        ):
+            written += self.writer.write(
+                Recipe.tags.through, ('recipe', 'tag'),
+                itertools.chain.from_iterable(tags for tags, _ in batch)
+            )
+            written += self.writer.write(
+                IngredientAmount, ('recipe', 'ingredients', 'amount'),
+                itertools.chain.from_iterable(
+                    amounts for _, amounts in batch
+                )
+            )
+            self.report(
+                'recipe tags and ingredients', written,
+                time.monotonic() - started
+            )
+
+    def get_activity(self, mean):
+        """Сколько связей у пользователя: в среднем mean, с тяжёлым хвостом."""
+        scale = mean * (ACTIVITY_ALPHA - 1) / ACTIVITY_ALPHA
+        return int(self.random.paretovariate(ACTIVITY_ALPHA) * scale)
+
+    def get_relation_rows(self, sampler, mean, exclude_self):
+        for user_id in self.user_ids:
+            targets = sampler.sample_distinct(self.get_activity(mean))
+            if exclude_self:
+                targets.discard(user_id)
+            for target_id in sorted(targets):
+                yield user_id, target_id
+
+    def generate_relation(self, relation, sampler, mean):
+        """Избранное, список покупок или подписки всех пользователей."""
+        model, user_field, obj_field, target = RELATIONS[relation]
+        self.write(relation, model, (user_field, obj_field), (
+            self.get_relation_rows(sampler, mean, target is User)
+        ))
+
+    def finish(self):
+        """Списки покупок, поисковые векторы и версия каталога."""
+        started = time.monotonic()
+        rebuilt = 0
+        for user_ids in batched(self.user_ids, self.batch_size):
+            cart.rebuild(user_ids)
+            rebuilt += len(user_ids)
+            self.report(
+                'shopping lists', rebuilt, time.monotonic() - started
+            )
+        for recipe_ids in batched(self.recipe_ids, self.batch_size):
+            update_search_vectors(recipe_ids)
+        versions.bump()
+        versions.bump(versions.RECIPES)
+        versions.bump(pantry.VERSION)
@@ -1,18 +1,73 @@
+from django import forms
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
 
-from .models import Recipe
+from . import catalog
+from .models import IngredientAmount, Recipe
+from .search import search_recipes
 
 User = get_user_model()
 
+# Сортировки рецептов по параметру ordering.
+ORDERINGS = {
+    'popular': ('-favorites_count', '-pub_date', '-id'),
+    'new': ('-pub_date', '-id'),
+}
 
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
+# Режимы фильтра по тегам: хотя бы один из тегов или все сразу.
+TAG_MODES = (('any', 'any'), ('all', 'all'))
+
+RecipeTag = Recipe.tags.through
+RecipeFavorite = Recipe.favorite.through
+RecipeCart = Recipe.cart.through
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in catalog.get().tag_ids_by_slug]
+
+
+class IdInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """id через запятую."""
+    field_class = forms.IntegerField
+
+
+def has_tags(tag_ids):
+    return Exists(RecipeTag.objects.filter(
+        recipe=OuterRef('pk'), tag__in=tag_ids
+    ))
+
+
+def has_ingredients(ingredient_ids):
+    return Exists(IngredientAmount.objects.filter(
+        recipe=OuterRef('pk'), ingredients__in=ingredient_ids
+    ))
+
+
+def filter_exists(queryset, name, exists, value=True):
+    """Фильтр по EXISTS: в Django 2.2 его можно только аннотировать."""
+    return queryset.annotate(**{name: exists}).filter(**{name: value})
 
 
 class TagAuthorFilter(FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    """Фильтры списка рецептов.
+
+    Теги и ингредиенты проверяются подзапросами EXISTS по индексам
+    связующих таблиц, поэтому строки рецептов не дублируются и DISTINCT
+    не нужен. tags_mode=all оставляет рецепты со всеми тегами,
+    ingredients — рецепты со всеми ингредиентами, exclude_ingredients —
+    рецепты без этих ингредиентов.
+    """
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags'
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAG_MODES, method='filter_tags_mode'
+    )
+    ingredients = IdInFilter(method='filter_ingredients')
+    exclude_ingredients = IdInFilter(method='filter_exclude_ingredients')
+    cooking_time = filters.RangeFilter()
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
     is_favorited = filters.BooleanFilter(
         method='filter_is_favorited'
@@ -20,17 +75,67 @@ class TagAuthorFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=tuple((key, key) for key in ORDERINGS),
+        method='filter_ordering'
+    )
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        slugs = catalog.get().tag_ids_by_slug
+        tag_ids = sorted({slugs[slug] for slug in value})
+        if self.form.cleaned_data.get('tags_mode') != 'all':
+            return filter_exists(queryset, 'has_tags', has_tags(tag_ids))
+        for tag_id in tag_ids:
+            queryset = filter_exists(
+                queryset, f'has_tag_{tag_id}', has_tags((tag_id,))
+            )
+        return queryset
+
+    def filter_tags_mode(self, queryset, name, value):
+        """Учитывается в filter_tags."""
+        return queryset
+
+    def filter_ingredients(self, queryset, name, value):
+        for ingredient_id in sorted(set(value)):
+            queryset = filter_exists(
+                queryset, f'has_ingredient_{ingredient_id}',
+                has_ingredients((ingredient_id,))
+            )
+        return queryset
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        if not value:
+            return queryset
+        return filter_exists(
+            queryset, 'has_excluded_ingredients',
+            has_ingredients(sorted(set(value))), False
+        )
 
     def filter_is_favorited(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(favorite=self.request.user)
+            return queryset.filter(id__in=RecipeFavorite.objects.filter(
+                user=self.request.user
+            ).values('recipe'))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(cart=self.request.user)
+            return queryset.filter(id__in=RecipeCart.objects.filter(
+                user=self.request.user
+            ).values('recipe'))
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        if value.strip():
+            return search_recipes(queryset, value)
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*ORDERINGS[value])
+
     class Meta:
         model = Recipe
         fields = ('tags', 'author')
@@ -0,0 +1,118 @@
+"""Уменьшенные копии картинок рецептов.
+
+После загрузки картинки рецепта копии из settings.RECIPE_IMAGE_RENDITIONS
+(в JPEG и WebP) строятся в пуле потоков, уже после ответа на запрос.
+В Recipe.image_renditions записывается имя картинки, для которой копии
+готовы; пока оно не совпадает с текущей картинкой, вместо копий
+отдаётся оригинал.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from . import versions
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+}
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_renditions(image_name):
+    """Копии картинки в виде {имя: (путь, размер, формат)}."""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return {
+        (name if image_format == 'JPEG' else f'{name}_webp'): (
+            f'recipe/renditions/{stem}_{name}.{extension}',
+            size,
+            image_format,
+        )
+        for name, size in settings.RECIPE_IMAGE_RENDITIONS.items()
+        for image_format, extension in FORMATS.items()
+    }
+
+
+def get_urls(recipe):
+    """Ссылки на копии картинки, пока их нет — на оригинал."""
+    if not recipe.image:
+        return {}
+    ready = recipe.image_renditions == recipe.image.name
+    return {
+        rendition: default_storage.url(path) if ready else recipe.image.url
+        for rendition, (path, size, image_format) in get_renditions(
+            recipe.image.name
+        ).items()
+    }
+
+
+def render(image, size, image_format):
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    if image_format == 'JPEG' and copy.mode != 'RGB':
+        copy = copy.convert('RGB')
+    data = BytesIO()
+    copy.save(data, image_format, quality=85)
+    return ContentFile(data.getvalue())
+
+
+def build(recipe_id, image_name):
+    """Строит копии картинки и отмечает их готовность у рецепта."""
+    with default_storage.open(image_name) as file:
+        image = Image.open(file)
+        image.load()
+    for path, size, image_format in get_renditions(image_name).values():
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, render(image, size, image_format))
+    if Recipe.objects.filter(
+        id=recipe_id, image=image_name
+    ).update(image_renditions=image_name, updated_at=timezone.now()):
+        versions.bump(versions.RECIPES)
+
+
+def run(recipe_id, image_name):
+    try:
+        build(recipe_id, image_name)
+    except Exception:
+        logger.exception('Не удалось сделать копии картинки %s', image_name)
+    finally:
+        connection.close()
+
+
+def submit(*args):
+    """Отдаёт задачу пулу потоков, создавая его при первом вызове."""
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images',
+            )
+        executor.submit(*args)
+
+
+def schedule(recipe):
+    """Ставит построение копий в очередь после коммита транзакции.
+
+    При RECIPE_IMAGE_WORKERS = 0 копии строятся сразу после коммита.
+    """
+    recipe_id, image_name = recipe.id, recipe.image.name
+    if settings.RECIPE_IMAGE_WORKERS:
+        transaction.on_commit(lambda: submit(run, recipe_id, image_name))
+    else:
+        transaction.on_commit(lambda: build(recipe_id, image_name))
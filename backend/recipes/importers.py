@@ -0,0 +1,274 @@
+"""Потоковая загрузка тегов, ингредиентов и рецептов из файлов.
+
+Файл читается построчно и делится на пачки, повторы внутри файла
+отбрасываются в памяти, а каждая пачка пишется в своей транзакции
+через bulk_create(ignore_conflicts=True) или, в Postgres, через COPY
+во временную таблицу. Строки, которые уже есть в базе, пропускаются,
+а версия каталога растёт после каждой пачки тегов и ингредиентов.
+
+Теги и ингредиенты читаются из CSV (как data/tags.csv
+и data/ingredients.csv), рецепты — из JSON Lines, по рецепту в строке:
+
+    {"author": "username", "name": "...", "text": "...",
+     "cooking_time": 10, "image": "recipe/file.jpg", "tags": ["lunch"],
+     "ingredients": [{"name": "соль", "measurement_unit": "г",
+                      "amount": 5}]}
+
+Ингредиенты рецептов, которых ещё нет в базе, создаются.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from . import counters, pantry, timeline, versions
+from .models import Ingredient, IngredientAmount, Recipe, Tag
+from .search import is_postgresql, update_search_vectors
+
+User = get_user_model()
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield [value.strip() for value in row]
+
+
+def read_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def batched(rows, size):
+    """Делит поток строк на списки не длиннее size."""
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+class Importer:
+    """Загрузка строк CSV в таблицу одной модели."""
+    model = None
+    fields = ()
+    read = staticmethod(read_csv)
+    can_copy = True
+
+    def __init__(self, use_copy=False):
+        self.use_copy = use_copy
+        self.seen = set()
+
+    def get_key(self, row):
+        return tuple(row)
+
+    def is_new(self, row):
+        """Запоминает строку и говорит, встречалась ли она раньше."""
+        if len(row) != len(self.fields):
+            raise ValueError(
+                f'{row}: ожидается колонок: {len(self.fields)}'
+            )
+        key = self.get_key(row)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def import_batch(self, rows):
+        """Пишет в базу пачку строк, возвращает число новых для файла."""
+        rows = [row for row in rows if self.is_new(row)]
+        if rows:
+            with transaction.atomic():
+                if self.use_copy:
+                    self.copy(rows)
+                else:
+                    self.write(rows)
+                if self.model is not None:
+                    versions.bump()
+        return len(rows)
+
+    def write(self, rows):
+        self.model.objects.bulk_create(
+            (self.model(**dict(zip(self.fields, row))) for row in rows),
+            ignore_conflicts=True,
+        )
+
+    def copy(self, rows):
+        """Загружает строки через COPY, минуя уже существующие."""
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        columns = ', '.join(
+            quote(self.model._meta.get_field(field).column)
+            for field in self.fields
+        )
+        data = io.StringIO()
+        csv.writer(data).writerows(rows)
+        data.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE import_rows ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            cursor.copy_expert(
+                f'COPY import_rows ({columns}) FROM STDIN WITH (FORMAT csv)',
+                data
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {columns} FROM import_rows ON CONFLICT DO NOTHING'
+            )
+
+    def copy_available(self):
+        return self.can_copy and is_postgresql()
+
+
+class TagImporter(Importer):
+    model = Tag
+    fields = ('name', 'color', 'slug')
+
+    def get_key(self, row):
+        return row[2]
+
+
+class IngredientImporter(Importer):
+    model = Ingredient
+    fields = ('name', 'measurement_unit')
+
+
+class RecipeImporter(Importer):
+    """Загрузка рецептов с тегами и количеством ингредиентов."""
+    read = staticmethod(read_json_lines)
+    can_copy = False
+
+    def __init__(self, use_copy=False):
+        super().__init__(use_copy)
+        self.authors = {}
+        self.tags = None
+        self.ingredients = {}
+
+    def is_new(self, row):
+        key = (row['author'], row['name'])
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def get_authors(self, usernames):
+        missing = set(usernames) - set(self.authors)
+        if missing:
+            self.authors.update(
+                User.objects.filter(
+                    username__in=missing
+                ).values_list('username', 'id')
+            )
+        unknown = set(usernames) - set(self.authors)
+        if unknown:
+            raise ValueError(f'Нет пользователей: {", ".join(unknown)}')
+        return {username: self.authors[username] for username in usernames}
+
+    def get_tag(self, slug):
+        if self.tags is None:
+            self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        if slug not in self.tags:
+            raise ValueError(f'Нет тега: {slug}')
+        return self.tags[slug]
+
+    def fetch_ingredients(self, keys):
+        for pk, name, unit in Ingredient.objects.filter(
+            name__in={name for name, unit in keys}
+        ).values_list('id', 'name', 'measurement_unit'):
+            self.ingredients[(name, unit)] = pk
+
+    def get_ingredients(self, keys):
+        """id ингредиентов по (название, единица), недостающие создаются."""
+        self.fetch_ingredients(set(keys) - set(self.ingredients))
+        missing = set(keys) - set(self.ingredients)
+        if missing:
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=name, measurement_unit=unit)
+                    for name, unit in missing
+                ),
+                ignore_conflicts=True,
+            )
+            versions.bump()
+            self.fetch_ingredients(missing)
+        return self.ingredients
+
+    def get_amounts(self, row):
+        """Количество ингредиентов рецепта, повторы складываются."""
+        amounts = {}
+        for item in row['ingredients']:
+            key = (item['name'].strip(), item['measurement_unit'].strip())
+            amounts[key] = amounts.get(key, 0) + int(item['amount'])
+        return amounts
+
+    def write(self, rows):
+        authors = self.get_authors({row['author'] for row in rows})
+        names = {row['name'] for row in rows}
+        existing = set(
+            Recipe.objects.filter(
+                author__in=authors.values(), name__in=names
+            ).values_list('author', 'name')
+        )
+        rows = [
+            row for row in rows
+            if (authors[row['author']], row['name']) not in existing
+        ]
+        if not rows:
+            return
+        Recipe.objects.bulk_create(
+            Recipe(
+                author_id=authors[row['author']],
+                name=row['name'],
+                text=row['text'],
+                cooking_time=int(row['cooking_time']),
+                image=row.get('image', ''),
+            ) for row in rows
+        )
+        recipe_ids = {
+            (author, name): pk
+            for pk, author, name in Recipe.objects.filter(
+                author__in=authors.values(), name__in=names
+            ).values_list('id', 'author', 'name')
+        }
+
+        amounts = {
+            recipe_ids[(authors[row['author']], row['name'])]:
+                self.get_amounts(row)
+            for row in rows
+        }
+        ingredients = self.get_ingredients(
+            {key for recipe in amounts.values() for key in recipe}
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(
+                recipe_id=recipe_ids[(authors[row['author']], row['name'])],
+                tag_id=self.get_tag(slug),
+            ) for row in rows for slug in set(row.get('tags', ()))
+        )
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
+                recipe_id=recipe_id,
+                ingredients_id=ingredients[key],
+                amount=amount,
+            )
+            for recipe_id, recipe in amounts.items()
+            for key, amount in recipe.items()
+        )
+        update_search_vectors(amounts.keys())
+        timeline.fan_out(amounts.keys())
+        pantry.recipes_changed(amounts.keys())
+        versions.bump(versions.RECIPES)
+        counters.reconcile(User.objects.filter(id__in=authors.values()))
+
+
+IMPORTERS = {
+    'tags': TagImporter,
+    'ingredients': IngredientImporter,
+    'recipes': RecipeImporter,
+}
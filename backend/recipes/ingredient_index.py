@@ -0,0 +1,91 @@
+"""Поиск ингредиентов для автодополнения без обращения к базе.
+
+Индекс строится из каталога в памяти (recipes.catalog) при первом поиске
+и перестраивается вместе с ним: отсортированный список названий для
+поиска по началу и отсортированный список суффиксов для поиска по части
+названия. Регистр и «ё»/«е» не различаются.
+"""
+import bisect
+import threading
+
+from django.conf import settings
+
+from . import catalog
+
+
+def fold(text):
+    """Приводит строку к виду, в котором ищем."""
+    return text.lower().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов."""
+
+    def __init__(self, ingredients):
+        ingredients = sorted(
+            ingredients,
+            key=lambda item: (fold(item['name']), item['id'])
+        )
+        self.items = ingredients
+        self.names = [fold(item['name']) for item in ingredients]
+        self.suffixes = sorted(
+            (name[start:], position)
+            for position, name in enumerate(self.names)
+            for start in range(1, len(name))
+        )
+
+    def search(self, query, limit):
+        """Ингредиенты, начинающиеся с query, затем содержащие query."""
+        query = fold(query.strip())
+        if not query:
+            return self.items[:limit]
+
+        found = []
+        start = bisect.bisect_left(self.names, query)
+        for position in range(start, len(self.names)):
+            if len(found) >= limit or not self.names[position].startswith(
+                query
+            ):
+                break
+            found.append(position)
+        if len(found) >= limit:
+            return [self.items[position] for position in found]
+
+        prefix = set(found)
+        infix = set()
+        start = bisect.bisect_left(self.suffixes, (query,))
+        for suffix, position in self.suffixes[start:]:
+            if not suffix.startswith(query):
+                break
+            if position not in prefix:
+                infix.add(position)
+        found.extend(sorted(infix)[:limit - len(found)])
+        return [self.items[position] for position in found]
+
+
+class IndexHolder:
+    """Хранит индекс и перестраивает его, когда перечитан каталог."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.catalog = None
+
+    def get(self, current=None):
+        current = current or catalog.get()
+        with self.lock:
+            if self.catalog is not current:
+                self.index = IngredientIndex(current.data['ingredients'])
+                self.catalog = current
+            return self.index
+
+
+holder = IndexHolder()
+
+
+def search(query, limit=None, current=None):
+    """Ищет ингредиенты по названию в каталоге current (по умолчанию —
+    в текущем)."""
+    if limit is None:
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+    return holder.get(current).search(query, limit)
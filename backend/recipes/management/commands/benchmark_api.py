@@ -0,0 +1,178 @@
+"""Модуль замеров числа запросов и времени ответа API"""
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from recipes import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a test database and measures queries and response time '
+        'of every API route; fails when a query budget or the query '
+        'baseline is exceeded, and, with --timings, when a route is '
+        'much slower than the timings recorded on this machine'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=50,
+            help='How many users to create'
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=500,
+            help='How many recipes to create'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Random seed of the dataset'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='How many times to time every request'
+        )
+        parser.add_argument(
+            '--baseline',
+            default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'),
+            help='JSON file with baseline query counts per database vendor'
+        )
+        parser.add_argument(
+            '--timings',
+            help='JSON file with median timings of this machine per '
+                 'database vendor; latency is checked only when given'
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Write measured query counts to the baseline file '
+                 'and, with --timings, medians to the timings file'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=2.0,
+            help='Allowed ratio of median time to the baseline'
+        )
+        parser.add_argument(
+            '--slack', type=float, default=5.0,
+            help='Milliseconds added to every latency limit'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        old_name = settings.DATABASES['default']['NAME']
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root, CACHES=benchmark.get_caches()
+            ):
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        baselines = self.read_baselines(options['baseline'])
+        timings = self.read_baselines(options['timings'])
+        failures = [
+            failure for result in results
+            for failure in self.compare(
+                result,
+                baselines.get(connection.vendor, {}),
+                timings.get(connection.vendor, {}),
+                options,
+            )
+        ]
+        if options['update_baseline']:
+            baselines[connection.vendor] = {
+                result.scenario.name: result.queries for result in results
+            }
+            self.write_baselines(options['baseline'], baselines)
+            if options['timings']:
+                timings[connection.vendor] = {
+                    result.scenario.name: round(benchmark.median(result), 2)
+                    for result in results
+                }
+                self.write_baselines(options['timings'], timings)
+        if failures:
+            raise CommandError(
+                f'{len(failures)} checks failed:\n' + '\n'.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(results)} requests within budget'
+        ))
+
+    def run(self, options):
+        data = benchmark.Dataset(
+            options['users'], options['recipes'], options['seed']
+        )
+        scenarios = benchmark.get_scenarios(data)
+        missing = benchmark.get_routes() - {
+            scenario.route for scenario in scenarios
+        }
+        if missing:
+            raise CommandError(
+                f'No benchmark for routes: {", ".join(sorted(missing))}'
+            )
+        results = []
+        for scenario in scenarios:
+            result = benchmark.measure(data, scenario, options['repeat'])
+            self.stdout.write(
+                f'{result.status} {result.queries:>3}/{scenario.budget:<3} '
+                f'{benchmark.median(result):>8.2f} ms  {scenario.name}'
+            )
+            results.append(result)
+        return results
+
+    def read_baselines(self, path):
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def write_baselines(self, path, baselines):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(
+                baselines, file, ensure_ascii=False, indent=2, sort_keys=True
+            )
+        self.stdout.write(f'Baseline written to {path}')
+
+    def compare(self, result, baseline, timings, options):
+        """Сообщения о превышении бюджета и базовых значений."""
+        scenario = result.scenario
+        if result.status != scenario.status:
+            yield (
+                f'{scenario.name}: status {result.status}, '
+                f'expected {scenario.status}'
+            )
+        if result.queries > scenario.budget:
+            yield (
+                f'{scenario.name}: {result.queries} queries, '
+                f'budget {scenario.budget}'
+            )
+        if options['update_baseline']:
+            return
+        if result.queries > baseline.get(scenario.name, result.queries):
+            yield (
+                f'{scenario.name}: {result.queries} queries, '
+                f'baseline {baseline[scenario.name]}'
+            )
+        if scenario.name not in timings:
+            return
+        limit = timings[scenario.name] * options['tolerance'] + (
+            options['slack']
+        )
+        if benchmark.median(result) > limit:
+            yield (
+                f'{scenario.name}: {benchmark.median(result):.2f} ms, '
+                f'limit {limit:.2f} ms'
+            )
@@ -0,0 +1,32 @@
+"""Модуль построения копий картинок рецептов"""
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Builds resized copies of recipe images that are missing or stale'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rebuild copies for every recipe'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.exclude(image_renditions=F('image'))
+        built = failed = 0
+        for recipe_id, image_name in recipes.values_list(
+            'id', 'image'
+        ).iterator():
+            try:
+                images.build(recipe_id, image_name)
+                built += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{image_name}: {error}')
+        self.stdout.write(f'{built} built, {failed} failed')
@@ -0,0 +1,89 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from recipes import benchmark, plans
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a test Postgres database, runs EXPLAIN for every query '
+        'of the API benchmark scenarios and fails when a plan reads '
+        'a large table sequentially'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='How many users to create'
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=3000,
+            help='How many recipes to create'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Random seed of the dataset'
+        )
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='Tables with at least this many rows must not be '
+                 'read sequentially'
+        )
+        parser.add_argument(
+            '--sql', action='store_true',
+            help='Print the SQL of every failing query'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans are checked on Postgres only')
+        old_name = settings.DATABASES['default']['NAME']
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root, CACHES=benchmark.get_caches()
+            ):
+                scans = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if scans:
+            raise CommandError(
+                f'{len(scans)} sequential scans of large tables:\n'
+                + '\n'.join(
+                    f'{scan.scenario.name}: {scan.table} ({scan.rows} rows)'
+                    + (f'\n  {scan.sql}' if options['sql'] else '')
+                    for scan in scans
+                )
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'No sequential scans of large tables'
+        ))
+
+    def run(self, options):
+        data = benchmark.Dataset(
+            options['users'], options['recipes'], options['seed']
+        )
+        sizes = plans.get_table_sizes()
+        scans = []
+        for scenario in benchmark.get_scenarios(data):
+            found = list(plans.check(
+                data, scenario, sizes, options['min_rows']
+            ))
+            self.stdout.write(
+                f'{len(found):>3} seq scans  {scenario.name}'
+            )
+            scans.extend(found)
+        return scans
@@ -0,0 +1,55 @@
+"""Модуль расчёта похожих рецептов"""
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.similarity import METRICS, SimilarityBuilder
+
+
+class Command(BaseCommand):
+    help = (
+        'Computes similar recipes by shared ingredients for recipes '
+        'changed since the last run (or for all with --full)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recompute every recipe'
+        )
+        parser.add_argument(
+            '--metric', choices=sorted(METRICS), default='cosine',
+            help='Similarity of ingredient sets'
+        )
+        parser.add_argument(
+            '--tag-weight', type=float, default=0.5,
+            help='Bonus for shared tags: score * (1 + weight * tag Jaccard)'
+        )
+        parser.add_argument(
+            '--top', type=int,
+            help='How many similar recipes to keep per recipe'
+        )
+        parser.add_argument(
+            '--max-recipes', type=int, default=1000,
+            help='Ingredients used by more recipes only add to the overlap '
+                 'of candidates found through rarer ingredients'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='How many recipes to write in one transaction'
+        )
+
+    def handle(self, *args, **options):
+        if options['top'] is not None and options['top'] < 1:
+            raise CommandError('--top must be at least 1')
+        builder = SimilarityBuilder(
+            metric=options['metric'],
+            tag_weight=options['tag_weight'],
+            top=options['top'],
+            max_recipes=options['max_recipes'],
+            batch_size=options['batch_size'],
+            report=self.report,
+        )
+        computed = builder.run(full=options['full'])
+        self.stdout.write(f'similar recipes: {computed} recipes computed')
+
+    def report(self, done, total):
+        self.stdout.write(f'{done}/{total} recipes')
@@ -0,0 +1,91 @@
+"""Модуль генерации синтетических данных для нагрузочных тестов"""
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.dataset import DatasetGenerator
+from recipes.search import is_postgresql
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a reproducible Zipf-distributed dataset of users, '
+        'recipes, favorites, shopping carts and subscriptions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='How many users to create'
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='How many recipes to create'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Mean number of favorite recipes per user'
+        )
+        parser.add_argument(
+            '--carts', type=int, default=3,
+            help='Mean number of recipes in a shopping cart'
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Mean number of subscriptions per user'
+        )
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Zipf exponent of recipe, author and ingredient popularity'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Random seed of the dataset'
+        )
+        parser.add_argument(
+            '--prefix', default='generated',
+            help='Username prefix of generated users'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='How many rows to write in one transaction'
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Use COPY instead of INSERT (PostgreSQL)'
+        )
+
+    def handle(self, *args, **options):
+        if options['copy'] and not is_postgresql():
+            raise CommandError('COPY is available on PostgreSQL')
+        generator = DatasetGenerator(
+            users=options['users'],
+            recipes=options['recipes'],
+            favorites=options['favorites'],
+            carts=options['carts'],
+            subscriptions=options['subscriptions'],
+            exponent=options['zipf'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            prefix=options['prefix'],
+            use_copy=options['copy'],
+            report=self.report,
+        )
+        started = time.monotonic()
+        try:
+            generator.run()
+        except ValueError as error:
+            raise CommandError(error)
+        for command in ('reconcile_counters', 'rebuild_timelines'):
+            call_command(
+                command, chunk_size=options['batch_size'], stdout=self.stdout
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Dataset generated in {time.monotonic() - started:.1f}s'
+        ))
+
+    def report(self, name, rows, seconds):
+        self.stdout.write(
+            f'{name}: {rows} rows, {rows / max(seconds, 1e-6):.0f} rows/s'
+        )
@@ -0,0 +1,53 @@
+"""Модуль потоковой загрузки данных в базу"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.importers import IMPORTERS, batched
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams tags or ingredients (CSV) or recipes (JSON Lines) '
+        'from a file into the database in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=IMPORTERS)
+        parser.add_argument('path')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='How many rows to write in one transaction'
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Use COPY instead of INSERT (PostgreSQL, tags/ingredients)'
+        )
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        importer = IMPORTERS[kind](use_copy=options['copy'])
+        if options['copy'] and not importer.copy_available():
+            raise CommandError(
+                'COPY is available for tags and ingredients on PostgreSQL'
+            )
+
+        started = time.monotonic()
+        read = unique = 0
+        try:
+            with open(options['path'], 'r', encoding='utf-8') as file:
+                for batch in batched(
+                    importer.read(file), options['batch_size']
+                ):
+                    unique += importer.import_batch(batch)
+                    read += len(batch)
+                    rate = read / max(time.monotonic() - started, 1e-6)
+                    self.stdout.write(
+                        f'{kind}: {read} rows read, {unique} unique, '
+                        f'{rate:.0f} rows/s'
+                    )
+        except (KeyError, TypeError, ValueError) as error:
+            raise CommandError(f'Bad row after {read} rows: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{kind}: done in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,36 @@
+"""Модуль пересборки лент подписок"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from recipes import timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds subscription timelines from subscriptions in chunks '
+        'of user ids'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='How many users to rebuild in one transaction'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        bounds = User.objects.aggregate(first=Min('id'), last=Max('id'))
+        rebuilt = 0
+        if bounds['first'] is not None:
+            for start in range(
+                bounds['first'], bounds['last'] + 1, chunk_size
+            ):
+                user_ids = list(User.objects.filter(
+                    id__gte=start, id__lt=start + chunk_size
+                ).values_list('id', flat=True))
+                timeline.rebuild(user_ids)
+                rebuilt += len(user_ids)
+        self.stdout.write(f'timelines: {rebuilt} rebuilt')
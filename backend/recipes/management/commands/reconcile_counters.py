@@ -0,0 +1,42 @@
+"""Модуль пересчёта счётчиков рецептов и пользователей"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from recipes import counters
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts favorites, shopping carts, recipes and followers '
+        'in chunks of ids'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='How many rows to update in one transaction'
+        )
+
+    def handle(self, *args, **options):
+        for model in (Recipe, User):
+            self.reconcile(model, options['chunk_size'])
+
+    def reconcile(self, model, chunk_size):
+        bounds = model.objects.aggregate(first=Min('id'), last=Max('id'))
+        updated = 0
+        if bounds['first'] is not None:
+            for start in range(
+                bounds['first'], bounds['last'] + 1, chunk_size
+            ):
+                with transaction.atomic():
+                    updated += counters.reconcile(model.objects.filter(
+                        id__gte=start, id__lt=start + chunk_size
+                    ))
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: {updated} reconciled'
+        )
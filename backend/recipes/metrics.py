@@ -0,0 +1,371 @@
+"""Метрики запросов к API в формате Prometheus.
+
+MetricsMiddleware замеряет для каждого запроса число и время запросов
+к базе, время сериализации и общее время ответа и складывает их
+в гистограммы по имени маршрута (recipes-list, users-subscriptions...).
+
+Каждый воркер gunicorn хранит свои гистограммы в памяти и не чаще раза
+в settings.METRICS_FLUSH_INTERVAL секунд сбрасывает их в собственный
+файл в settings.METRICS_DIR; /metrics/ складывает файлы всех воркеров,
+так что Prometheus видит сумму, в какой бы воркер ни попал запрос.
+Данные воркеров, процессов которых уже нет, при сборе под файловой
+блокировкой переносятся в архив ARCHIVE, а их файлы удаляются: архив
+входит в сумму, поэтому счётчики не уменьшаются после перезапуска
+воркеров.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.crypto import constant_time_compare
+from rest_framework.serializers import ListSerializer, Serializer
+
+from .profiling import get_staff_user
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMS = {
+    'foodgram_request_duration_seconds': (
+        'Total response time', DURATION_BUCKETS,
+    ),
+    'foodgram_request_db_duration_seconds': (
+        'Time spent in SQL queries', DURATION_BUCKETS,
+    ),
+    'foodgram_request_db_queries': (
+        'Number of SQL queries', QUERY_BUCKETS,
+    ),
+    'foodgram_request_serializer_duration_seconds': (
+        'Time spent serializing responses', DURATION_BUCKETS,
+    ),
+}
+REQUESTS_TOTAL = 'foodgram_requests_total'
+
+# Данные завершившихся воркеров и блокировка для его изменения.
+ARCHIVE = 'archive.dat'
+ARCHIVE_LOCK = 'archive.lock'
+
+local = threading.local()
+
+
+class RequestTimings:
+    """Запросы к базе и сериализация одного HTTP-запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def measure(self, get_response, request):
+        """Выполняет запрос, замеряя все обращения к базам."""
+        local.timings = self
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self))
+                return get_response(request)
+        finally:
+            local.timings = None
+
+
+def timed_data(data):
+    """Свойство data сериализатора, которое замеряет своё время.
+
+    Вложенные сериализаторы не замеряются отдельно: их время уже
+    входит во время внешнего.
+    """
+    def get_data(serializer):
+        timings = getattr(local, 'timings', None)
+        if timings is None or timings.serializing:
+            return data.fget(serializer)
+        timings.serializing = True
+        started = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            timings.serializer_time += time.perf_counter() - started
+            timings.serializing = False
+    return property(get_data)
+
+
+def instrument_serializers():
+    for serializer_class in (Serializer, ListSerializer):
+        serializer_class.data = timed_data(serializer_class.data)
+
+
+def is_alive(pid):
+    """Работает ли процесс с таким pid."""
+    if not pid.isdecimal():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def read(path):
+    """Данные файла метрик или None, если его нет или он испорчен."""
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write(path, data):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def merge(histograms, counters, data):
+    """Прибавляет данные файла к суммам."""
+    for name, labels, row in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, [0] * len(row))
+        for number, value in enumerate(row):
+            total[number] += value
+    for name, labels, value in data['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+
+
+def to_data(histograms, counters):
+    return {
+        'histograms': [
+            [name, labels, row] for (name, labels), row in histograms.items()
+        ],
+        'counters': [
+            [name, labels, value]
+            for (name, labels), value in counters.items()
+        ],
+    }
+
+
+def read_workers():
+    """Сумма данных архива и файлов всех воркеров.
+
+    Данные завершившихся воркеров переносятся в архив, а их файлы
+    удаляются. Всё читается под блокировкой, чтобы параллельный сбор
+    не удалил файл между чтением архива и чтением файлов. Имена
+    перенесённых файлов хранятся в архиве, пока файлы не удалены:
+    сбой между записью архива и удалением не учтёт их дважды.
+    """
+    directory = settings.METRICS_DIR
+    with open(os.path.join(directory, ARCHIVE_LOCK), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive = read(os.path.join(directory, ARCHIVE)) or {
+            'histograms': [], 'counters': [], 'merged': [],
+        }
+        histograms, counters = {}, {}
+        merge(histograms, counters, archive)
+        merged = set(archive['merged'])
+        live, dead = [], []
+        for file_name in os.listdir(directory):
+            if not file_name.endswith('.json'):
+                continue
+            data = read(os.path.join(directory, file_name))
+            if is_alive(file_name.split('-')[0]):
+                live.append(data)
+            else:
+                dead.append(file_name)
+                if data is not None and file_name not in merged:
+                    merge(histograms, counters, data)
+                    merged.add(file_name)
+        if dead:
+            archive = to_data(histograms, counters)
+            archive['merged'] = sorted(merged)
+            write(os.path.join(directory, ARCHIVE), archive)
+            for file_name in dead:
+                remove(os.path.join(directory, file_name))
+            archive['merged'] = []
+            write(os.path.join(directory, ARCHIVE), archive)
+    for data in live:
+        if data is not None:
+            merge(histograms, counters, data)
+    return histograms, counters
+
+
+def is_allowed(request):
+    """Может ли запрос читать метрики: сотрудник или токен Prometheus."""
+    if get_staff_user(request) is not None:
+        return True
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    return bool(
+        settings.METRICS_TOKEN and len(header) == 2
+        and header[0] == 'Bearer'
+        and constant_time_compare(header[1], settings.METRICS_TOKEN)
+    )
+
+
+class MetricsStore:
+    """Гистограммы и счётчики процесса с записью в файл воркера."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+        self.flushed_at = 0
+
+    def check_fork(self):
+        """После fork данные родителя не должны попасть в файл потомка."""
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.path = os.path.join(
+                settings.METRICS_DIR, f'{self.pid}-{time.time():.0f}.json'
+            )
+            self.reset()
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = [0] * len(buckets) + [0, 0]
+        row = self.histograms[key]
+        for number, bound in enumerate(buckets):
+            if value <= bound:
+                row[number] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def record(self, route, method, status, timings, total):
+        labels = (('route', route), ('method', method))
+        with self.lock:
+            self.check_fork()
+            self.observe('foodgram_request_duration_seconds', labels, total)
+            self.observe(
+                'foodgram_request_db_duration_seconds', labels,
+                timings.db_time
+            )
+            self.observe(
+                'foodgram_request_db_queries', labels, timings.queries
+            )
+            self.observe(
+                'foodgram_request_serializer_duration_seconds', labels,
+                timings.serializer_time
+            )
+            key = (REQUESTS_TOTAL, labels + (('status', str(status)),))
+            self.counters[key] = self.counters.get(key, 0) + 1
+            if time.monotonic() - self.flushed_at >= (
+                settings.METRICS_FLUSH_INTERVAL
+            ):
+                self.flush()
+
+    def flush(self):
+        """Записывает данные процесса в его файл (под self.lock)."""
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write(self.path, to_data(self.histograms, self.counters))
+        self.flushed_at = time.monotonic()
+
+    def collect(self):
+        """Сумма данных всех воркеров, в том числе завершившихся."""
+        with self.lock:
+            self.check_fork()
+            self.flush()
+        return read_workers()
+
+
+store = MetricsStore()
+
+
+def format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name, str(value).replace('\\', r'\\').replace('"', r'\"')
+        ) for name, value in pairs
+    ) + '}'
+
+
+def render():
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    histograms, counters = store.collect()
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for (row_name, labels), row in sorted(histograms.items()):
+            if row_name != name:
+                continue
+            for bound, count in zip(buckets, row):
+                lines.append(
+                    f'{name}_bucket{format_labels(labels, le=bound)} {count}'
+                )
+            lines.append(
+                f'{name}_bucket{format_labels(labels, le="+Inf")} {row[-1]}'
+            )
+            lines.append(f'{name}_sum{format_labels(labels)} {row[-2]}')
+            lines.append(f'{name}_count{format_labels(labels)} {row[-1]}')
+    lines.append(f'# HELP {REQUESTS_TOTAL} Requests by status')
+    lines.append(f'# TYPE {REQUESTS_TOTAL} counter')
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f'{name}{format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name
+
+
+def server_timing(timings, total):
+    return (
+        f'db;dur={timings.db_time * 1000:.1f};'
+        f'desc="{timings.queries} queries", '
+        f'serializer;dur={timings.serializer_time * 1000:.1f}, '
+        f'total;dur={total * 1000:.1f}'
+    )
+
+
+class MetricsMiddleware:
+    """Замеряет запрос; сотрудникам отдаёт замеры в Server-Timing."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        started = time.perf_counter()
+        response = timings.measure(self.get_response, request)
+        total = time.perf_counter() - started
+        store.record(
+            get_route(request), request.method, response.status_code,
+            timings, total
+        )
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = server_timing(timings, total)
+        return response
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+def fill_versions(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    DataVersion = apps.get_model('recipes', 'DataVersion')
+    Recipe.objects.update(updated_at=models.F('pub_date'))
+    DataVersion.objects.get_or_create(name='catalog')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='данные')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='дата изменения')),
+            ],
+            options={
+                'verbose_name': 'версия данных',
+                'verbose_name_plural': 'версии данных',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='дата изменения'),
+        ),
+        migrations.RunPython(fill_versions, migrations.RunPython.noop),
+    ]
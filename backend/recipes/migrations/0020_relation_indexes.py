@@ -0,0 +1,23 @@
+# Generated by Django 2.2.16 on 2026-10-18 21:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX recipe_favorite_user_recipe_idx '
+            'ON recipes_recipe_favorite (user_id, recipe_id)',
+            'DROP INDEX recipe_favorite_user_recipe_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX recipe_cart_user_recipe_idx '
+            'ON recipes_recipe_cart (user_id, recipe_id)',
+            'DROP INDEX recipe_cart_user_recipe_idx',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_relation_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_updated_at_idx',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_version',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='версия состава'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['ingredients_version'], name='recipe_ingredients_version_idx'),
+        ),
+    ]
@@ -1,37 +1,122 @@
+from calendar import timegm
+from hashlib import md5
+
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.http import http_date
 from rest_framework.response import Response
 from rest_framework.status import (HTTP_201_CREATED, HTTP_204_NO_CONTENT,
                                    HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED)
 
+from . import relations
+
 
 class AddRemoveMixin:
     """Добавление доп. функций во вьюсет."""
     extra_serializer = None
 
+    def perform_add(self, field, ids):
+        """Вызывается после добавления связей, в той же транзакции."""
+
+    def perform_remove(self, field, ids):
+        """Вызывается после удаления связей, в той же транзакции."""
+
+    def change_relation(self, our_field, ids):
+        """Добавляет (POST, GET) или удаляет (DELETE) связи с объектами.
+
+        Возвращает id объектов, у которых связь действительно изменилась.
+        """
+        user = self.request.user
+        with transaction.atomic():
+            if self.request.method == 'DELETE':
+                changed = relations.remove(our_field, user, ids)
+                self.perform_remove(our_field, changed)
+            else:
+                changed = relations.add(our_field, user, ids)
+                self.perform_add(our_field, changed)
+        return changed
+
     def add_remove_obj(self, obj_id, our_field):
         """Добавляет или удаляет зависимость many-to-many."""
-        user = self.request.user
-        if user.is_anonymous:
+        if self.request.user.is_anonymous:
             return Response(status=HTTP_401_UNAUTHORIZED)
 
-        fields = {
-            'subscribe': user.subscribe,
-            'favorite': user.favorites,
-            'shopping_cart': user.carts,
-        }
-        our_field = fields[our_field]
-
         obj = get_object_or_404(self.queryset, id=obj_id)
+        if not self.change_relation(our_field, (obj.id,)):
+            return Response(status=HTTP_400_BAD_REQUEST)
+        if self.request.method == 'DELETE':
+            return Response(status=HTTP_204_NO_CONTENT)
         serializer = self.extra_serializer(
             obj, context={'request': self.request}
         )
-        obj_exist = our_field.filter(id=obj_id).exists()
+        return Response(serializer.data, status=HTTP_201_CREATED)
 
-        if (self.request.method in ('GET', 'POST',)) and not obj_exist:
-            our_field.add(obj)
-            return Response(serializer.data, status=HTTP_201_CREATED)
+    def add_remove_batch(self, our_field):
+        """Добавляет или удаляет связи со списком объектов из поля ids.
 
-        if (self.request.method in ('DELETE',)) and obj_exist:
-            our_field.remove(obj)
-            return Response(status=HTTP_204_NO_CONTENT)
-        return Response(status=HTTP_400_BAD_REQUEST)
+        Уже существующие (или отсутствующие при удалении) связи
+        и несуществующие объекты пропускаются; в ответе — id объектов,
+        у которых связь изменилась.
+        """
+        if self.request.user.is_anonymous:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+
+        data = self.request.data
+        ids = data.get('ids') if isinstance(data, dict) else None
+        limit = settings.RELATION_BATCH_LIMIT
+        if not isinstance(ids, list) or not all(
+            str(pk).isdecimal() for pk in ids
+        ):
+            return Response(
+                {'ids': ['Ожидается список id']},
+                status=HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > limit:
+            return Response(
+                {'ids': [f'Не больше {limit} id за раз']},
+                status=HTTP_400_BAD_REQUEST
+            )
+        changed = self.change_relation(our_field, {int(pk) for pk in ids})
+        return Response({'ids': changed})
+
+
+class ConditionalGetMixin:
+    """Ответ 304 на list и retrieve, если данные не изменились.
+
+    Вьюсет возвращает из get_validators части ETag и время изменения
+    (или None, если проверять нечего); сериализаторы при совпадении
+    If-None-Match/If-Modified-Since не запускаются.
+    """
+
+    def get_validators(self, request):
+        """(части ETag, время изменения или None) либо None."""
+
+    def conditional(self, handler, request, *args, **kwargs):
+        validators = self.get_validators(request)
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        parts, last_modified = validators
+        etag = quote_etag(
+            md5(repr(parts).encode()).hexdigest()
+        )
+        timestamp = last_modified and timegm(last_modified.utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp:
+                response['Last-Modified'] = http_date(timestamp)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
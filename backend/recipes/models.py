@@ -1,7 +1,9 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models.functions import Length
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length, RowNumber
 
 models.CharField.register_lookup(Length)
 
@@ -85,6 +87,86 @@ class Ingredient(models.Model):
         return f'{self.name} {self.measurement_unit}'
 
 
+class RawSubquery(RawSQL):
+    """Подзапрос на SQL для __in: скобки вокруг него ставит сам lookup."""
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов."""
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги избранного и корзины для пользователя."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(False, models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Recipe.favorite.through.objects.filter(
+                    recipe=models.OuterRef('pk'), user=user
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                Recipe.cart.through.objects.filter(
+                    recipe=models.OuterRef('pk'), user=user
+                )
+            ),
+        )
+
+    def latest_per_author(self, author_ids, limit):
+        """Не больше limit последних рецептов каждого из авторов.
+
+        Рецепты нумеруются оконной функцией внутри автора, так что
+        из базы приходят только нужные строки.
+        """
+        ranked = Recipe.objects.filter(
+            author__in=author_ids
+        ).annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F('author'),
+                order_by=(models.F('pub_date').desc(), models.F('id').desc()),
+            )
+        ).order_by().values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(id__in=RawSubquery(
+            f'SELECT "id" FROM ({sql}) AS ranked WHERE "row_number" <= %s',
+            (*params, limit)
+        ))
+
+    def for_serializer(self, user):
+        """Подгружает всё, что нужно для вывода рецептов пользователю."""
+        if user.is_anonymous:
+            is_subscribed = models.Value(False, models.BooleanField())
+        else:
+            is_subscribed = models.Exists(
+                User.subscribe.through.objects.filter(
+                    from_user=user, to_user=models.OuterRef('pk')
+                )
+            )
+        return self.with_user_flags(user).defer(
+            'search_vector'
+        ).prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredient',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredients'
+                ).order_by('ingredients__name'),
+            ),
+            models.Prefetch(
+                'author',
+                queryset=User.objects.annotate(is_subscribed=is_subscribed),
+            ),
+        )
+
+
 class Recipe(models.Model):
     """Модель рецептов."""
     tags = models.ManyToManyField(
@@ -122,6 +204,12 @@ class Recipe(models.Model):
         verbose_name='ссылка на картинку на сайте',
         upload_to='recipe/',
     )
+    image_renditions = models.CharField(
+        verbose_name='картинка, для которой готовы копии',
+        max_length=100,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         verbose_name='описание',
     )
@@ -133,11 +221,62 @@ class Recipe(models.Model):
         verbose_name='дата публикации',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='в избранном',
+        default=0,
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name='в списках покупок',
+        default=0,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='поисковый вектор',
+        null=True,
+        editable=False,
+    )
+    similar_computed_at = models.DateTimeField(
+        verbose_name='похожие рецепты посчитаны',
+        null=True,
+        editable=False,
+    )
+    ingredients_version = models.BigIntegerField(
+        verbose_name='версия состава',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'рецепт'
         verbose_name_plural = 'рецепты'
         ordering = ('-pub_date', )
+        indexes = (
+            models.Index(
+                fields=('pub_date', 'id'),
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('author', 'pub_date', 'id'),
+                name='recipe_author_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('favorites_count', 'pub_date'),
+                name='recipe_popularity_idx',
+            ),
+            models.Index(
+                fields=('ingredients_version',),
+                name='recipe_ingredients_version_idx',
+            ),
+            models.Index(
+                fields=('cooking_time', 'pub_date'),
+                name='recipe_cooking_time_idx',
+            ),
+        )
         constraints = (
             models.UniqueConstraint(
                 fields=('name', 'author'),
@@ -177,6 +316,12 @@ class IngredientAmount(models.Model):
         verbose_name = 'количество ингредиента'
         verbose_name_plural = 'количество ингредиентов'
         ordering = ('recipe', )
+        indexes = (
+            models.Index(
+                fields=('ingredients', 'recipe'),
+                name='amount_ingredient_recipe_idx',
+            ),
+        )
         constraints = (
             models.UniqueConstraint(
                 fields=('recipe', 'ingredients', ),
@@ -186,3 +331,146 @@ class IngredientAmount(models.Model):
 
     def __str__(self) -> str:
         return f'{self.amount} {self.ingredients}'
+
+
+class CartIngredient(models.Model):
+    """Модель суммарного количества ингредиентов в списке покупок."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='пользователь',
+        related_name='cart_ingredients',
+        on_delete=models.CASCADE,
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='ингредиент',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    amount = models.IntegerField(
+        verbose_name='количество',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'ингредиент в списке покупок'
+        verbose_name_plural = 'ингредиенты в списке покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient', ),
+                name='cart_ingredient_unique',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.amount} {self.ingredient}'
+
+
+class DataVersion(models.Model):
+    """Модель версии данных, общей для всех процессов."""
+    name = models.CharField(
+        verbose_name='данные',
+        max_length=50,
+        unique=True,
+    )
+    version = models.PositiveIntegerField(
+        verbose_name='версия',
+        default=0,
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='дата изменения',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'версия данных'
+        verbose_name_plural = 'версии данных'
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.version}'
+
+
+class TimelineEntry(models.Model):
+    """Модель рецепта в ленте подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='читатель',
+        related_name='timeline',
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='рецепт',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='автор рецепта',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи ленты'
+        indexes = (
+            models.Index(
+                fields=('user', 'pub_date', 'recipe'),
+                name='timeline_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx',
+            ),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='timeline_entry_unique',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.recipe_id}'
+
+
+class RecipeSimilarity(models.Model):
+    """Модель похожего рецепта, посчитанного заранее."""
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='рецепт',
+        related_name='similar_rows',
+        on_delete=models.CASCADE,
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        verbose_name='похожий рецепт',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    score = models.FloatField(
+        verbose_name='сходство',
+    )
+
+    class Meta:
+        verbose_name = 'похожий рецепт'
+        verbose_name_plural = 'похожие рецепты'
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similarity_recipe_score_idx',
+            ),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='recipe_similarity_unique',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id} ~ {self.similar_id}: {self.score:.3f}'
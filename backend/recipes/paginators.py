@@ -1,6 +1,233 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from itertools import islice
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     """Пагинатор с выводом определенного кол-ва страниц (limit)."""
     page_size_query_param = 'limit'
+
+
+class IdCountPaginator(Paginator):
+    """Считает только id: аннотации для вывода (флаги пользователя)
+    не попадают в COUNT и не превращают его в GROUP BY."""
+
+    @cached_property
+    def count(self):
+        return self.object_list.order_by().values('pk').count()
+
+
+class RecipePagination(CustomPageNumberPagination):
+    """Пагинатор рецептов: по номеру страницы или по курсору.
+
+    С параметром cursor (пустым для первой страницы) рецепты отдаются
+    по ключу (pub_date, id) без COUNT и OFFSET, поэтому дальние страницы
+    не медленнее первых, а новые рецепты не сдвигают уже открытые.
+    Курсор работает только с порядком «новые первыми»: вместе
+    с поиском или другой сортировкой он даёт ошибку 400.
+    """
+    django_paginator_class = IdCountPaginator
+    cursor_query_param = 'cursor'
+    cursor_page_size = 10
+    invalid_cursor_message = 'Неверный курсор.'
+    unordered_cursor_message = (
+        'Курсор нельзя сочетать с поиском и сортировкой, кроме new.'
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        params = request.query_params
+        if params.get('search', '').strip() or params.get(
+            'ordering', 'new'
+        ) != 'new':
+            raise ValidationError(
+                {self.cursor_query_param: [self.unordered_cursor_message]}
+            )
+        self.request = request
+        self.limit = self.get_page_size(request) or self.cursor_page_size
+        cursor = request.query_params[self.cursor_query_param]
+        pub_date, pk, reverse = self.decode_cursor(cursor)
+
+        if pub_date is None:
+            queryset = queryset.order_by('-pub_date', '-id')
+        elif reverse:
+            queryset = queryset.filter(
+                Q(pub_date__gte=pub_date),
+                Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=pk)
+            ).order_by('pub_date', 'id')
+        else:
+            queryset = queryset.filter(
+                Q(pub_date__lte=pub_date),
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+            ).order_by('-pub_date', '-id')
+
+        page = list(queryset[:self.limit + 1])
+        has_more = len(page) > self.limit
+        page = page[:self.limit]
+        if reverse:
+            page.reverse()
+        self.next_item = page[-1] if page and (has_more or reverse) else None
+        self.previous_item = (
+            page[0] if page and pub_date is not None and (
+                has_more or not reverse
+            ) else None
+        )
+        return page
+
+    def decode_cursor(self, cursor):
+        """Возвращает (pub_date, id, назад ли) или None для первой страницы."""
+        if not cursor:
+            return None, None, False
+        try:
+            reverse, pub_date, pk = urlsafe_b64decode(
+                cursor.encode('ascii')
+            ).decode('ascii').split('|')
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk, reverse == 'r'
+
+    def encode_cursor(self, recipe, reverse):
+        cursor = urlsafe_b64encode(
+            f'{"r" if reverse else "f"}|'
+            f'{recipe.pub_date.isoformat()}|{recipe.id}'.encode('ascii')
+        ).decode('ascii')
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor,
+        )
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if self.next_item is None:
+            return None
+        return self.encode_cursor(self.next_item, reverse=False)
+
+    def get_previous_link(self):
+        if not self.use_cursor:
+            return super().get_previous_link()
+        if self.previous_item is None:
+            return None
+        return self.encode_cursor(self.previous_item, reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict((
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        )))
+
+
+class FeedPagination(RecipePagination):
+    """Пагинатор ленты подписок: только вперёд по курсору (pub_date, id).
+
+    fetch(pub_date, id, count) возвращает до count рецептов после
+    курсора (pub_date None — с начала ленты).
+    """
+
+    def paginate_feed(self, request, fetch):
+        self.use_cursor = True
+        self.request = request
+        self.limit = self.get_page_size(request) or self.cursor_page_size
+        pub_date, pk, reverse = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param, '')
+        )
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+        page = fetch(pub_date, pk, self.limit + 1)
+        has_more = len(page) > self.limit
+        page = page[:self.limit]
+        self.next_item = page[-1] if has_more else None
+        self.previous_item = None
+        return page
+
+
+class RankedPagination(CustomPageNumberPagination):
+    """Пагинатор списка, отсортированного в памяти: по номеру страницы,
+    без COUNT.
+
+    ranked — итератор кортежей, первый элемент которых id рецепта,
+    keep(ids) возвращает те id из пачки, что проходят фильтры. Страницы
+    дальше первых max_results результатов не отдаются (404), а из
+    ранжирования читается не больше max_scanned id: с редким фильтром
+    страница выходит короче или пустой и без ссылки на следующую,
+    зато стоит не больше max_scanned / chunk_size запросов.
+    """
+    page_size = 10
+    max_page_size = 100
+    max_results = 1000
+    chunk_size = 500
+    max_scanned = 5000
+    invalid_page_message = 'Неверная страница.'
+
+    def paginate_ranked(self, request, ranked, keep):
+        self.request = request
+        limit = self.get_page_size(request)
+        page = request.query_params.get(self.page_query_param, '1')
+        if not page.isdecimal() or int(page) < 1:
+            raise NotFound(self.invalid_page_message)
+        self.page_number = int(page)
+        start = (self.page_number - 1) * limit
+        if start + limit > self.max_results:
+            raise NotFound(self.invalid_page_message)
+        found = []
+        scanned = 0
+        while len(found) <= start + limit and scanned < self.max_scanned:
+            chunk = list(islice(ranked, min(
+                max(self.chunk_size, limit + 1), self.max_scanned - scanned
+            )))
+            if not chunk:
+                break
+            scanned += len(chunk)
+            kept = keep([item[0] for item in chunk])
+            found.extend(item for item in chunk if item[0] in kept)
+        self.has_next = (
+            len(found) > start + limit
+            and start + 2 * limit <= self.max_results
+        )
+        return found[start:start + limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.page_query_param,
+            self.page_number + 1,
+        )
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.page_query_param, self.page_number - 1
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        )))
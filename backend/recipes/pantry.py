@@ -0,0 +1,193 @@
+"""Подбор рецептов по продуктам, которые есть у пользователя.
+
+В памяти процесса хранится обратный индекс из IngredientAmount:
+для каждого ингредиента — отсортированный массив id рецептов,
+для каждого рецепта — число его ингредиентов. Совпадения считаются
+проходом по массивам ингредиентов пользователя, рецепты ранжируются
+по доле ингредиентов, которые у пользователя уже есть.
+
+Индекс строится при первом обращении. Каждая транзакция, которая
+меняет состав рецептов, увеличивает версию CHANGES и записывает её
+в Recipe.ingredients_version. Строка версии заблокирована до коммита,
+поэтому версии коммитятся по порядку, и если процесс видит версию N,
+то видит и все рецепты с версией не больше N. Не чаще раза
+в settings.PANTRY_CHECK_INTERVAL секунд процесс сверяет версию
+и дочитывает только рецепты с версией новее прошлой сверки, а в
+процессе, где рецепт сохранён, он обновляется сразу после коммита.
+Если изменилась больше чем REFRESH_SHARE индекса, он строится заново.
+Удалённые рецепты остаются в индексе, но отсеиваются при выборке
+из базы. Загрузки, которые пишут рецепты в обход recipes_changed,
+увеличивают версию VERSION, и индекс строится заново.
+"""
+import bisect
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Subquery
+
+from . import versions
+from .models import DataVersion, IngredientAmount, Recipe
+
+VERSION = 'pantry'
+CHANGES = 'pantry_changes'
+
+# Какую долю индекса дочитывать, больше — строить индекс заново.
+REFRESH_SHARE = 0.01
+# Сколько изменённых рецептов дочитывать в любом случае.
+REFRESH_MIN = 100
+
+
+class PantryIndex:
+    """Ингредиент → отсортированные id рецептов и размеры рецептов."""
+
+    def __init__(self, rows=()):
+        postings = defaultdict(list)
+        for ingredient_id, recipe_id in rows:
+            postings[ingredient_id].append(recipe_id)
+        self.postings = {
+            ingredient_id: array('i', sorted(recipe_ids))
+            for ingredient_id, recipe_ids in postings.items()
+        }
+        self.sizes = array('H')
+        for recipe_ids in self.postings.values():
+            for recipe_id in recipe_ids:
+                self.grow(recipe_id)
+                self.sizes[recipe_id] += 1
+
+    def grow(self, recipe_id):
+        if recipe_id >= len(self.sizes):
+            self.sizes.extend([0] * (recipe_id + 1 - len(self.sizes)))
+
+    def update(self, recipe_ids, rows):
+        """Заменяет состав рецептов recipe_ids на строки rows."""
+        for recipe_ids_of in self.postings.values():
+            for recipe_id in recipe_ids:
+                position = bisect.bisect_left(recipe_ids_of, recipe_id)
+                if position < len(recipe_ids_of) and (
+                    recipe_ids_of[position] == recipe_id
+                ):
+                    del recipe_ids_of[position]
+        for recipe_id in recipe_ids:
+            self.grow(recipe_id)
+            self.sizes[recipe_id] = 0
+        for ingredient_id, recipe_id in rows:
+            recipe_ids_of = self.postings.setdefault(
+                ingredient_id, array('i')
+            )
+            bisect.insort(recipe_ids_of, recipe_id)
+            self.sizes[recipe_id] += 1
+
+    def rank(self, ingredient_ids, min_coverage=0):
+        """id рецептов с (совпало, всего) от большей доли совпадений
+        к меньшей, при равной доле — больше совпадений, новее."""
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(self.postings.get(ingredient_id, ()))
+        buckets = defaultdict(list)
+        sizes = self.sizes
+        for recipe_id, count in matched.items():
+            buckets[count, sizes[recipe_id]].append(recipe_id)
+        for count, size in sorted(
+            buckets, key=lambda key: (key[0] / key[1], key[0]), reverse=True
+        ):
+            if count / size < min_coverage:
+                break
+            for recipe_id in sorted(buckets[count, size], reverse=True):
+                yield recipe_id, count, size
+
+
+class PantryHolder:
+    """Хранит индекс, дочитывает изменения и строит его заново
+    при смене версии."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.changes = None
+        self.checked_at = 0
+
+    def build(self, version, changes):
+        """Строит индекс; версии прочитаны до чтения состава."""
+        self.index = PantryIndex(
+            IngredientAmount.objects.values_list(
+                'ingredients', 'recipe'
+            ).iterator()
+        )
+        self.version = version
+        self.changes = changes
+
+    def refresh_limit(self):
+        return max(REFRESH_MIN, int(len(self.index.sizes) * REFRESH_SHARE))
+
+    def refresh(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if len(recipe_ids) > self.refresh_limit():
+            self.build(self.version, self.changes)
+            return
+        self.index.update(
+            recipe_ids,
+            IngredientAmount.objects.filter(
+                recipe__in=recipe_ids
+            ).values_list('ingredients', 'recipe')
+        )
+
+    def sync(self, changes):
+        """Дочитывает рецепты, изменённые после прошлой сверки."""
+        if changes == self.changes:
+            return
+        changed = Recipe.objects.filter(
+            ingredients_version__gt=self.changes,
+            ingredients_version__lte=changes,
+        ).values_list('id', flat=True)
+        recipe_ids = list(changed[:self.refresh_limit() + 1])
+        if len(recipe_ids) > self.refresh_limit():
+            self.build(self.version, changes)
+            return
+        self.refresh(recipe_ids)
+        self.changes = changes
+
+    def get(self):
+        interval = settings.PANTRY_CHECK_INTERVAL
+        with self.lock:
+            if self.index is not None and (
+                time.monotonic() - self.checked_at < interval
+            ):
+                return self.index
+            version, changes = versions.get_many(VERSION, CHANGES)
+            if self.index is None or self.version != version:
+                self.build(version, changes)
+            else:
+                self.sync(changes)
+            self.checked_at = time.monotonic()
+            return self.index
+
+    def changed(self, recipe_ids):
+        with self.lock:
+            if self.index is not None:
+                self.refresh(recipe_ids)
+
+
+holder = PantryHolder()
+
+
+def get():
+    return holder.get()
+
+
+def recipes_changed(recipe_ids):
+    """Отмечает новый состав рецептов для всех процессов и обновляет
+    индекс этого процесса после коммита текущей транзакции."""
+    recipe_ids = list(recipe_ids)
+    with transaction.atomic():
+        versions.bump(CHANGES)
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            ingredients_version=Subquery(
+                DataVersion.objects.filter(name=CHANGES).values('version')[:1]
+            )
+        )
+    transaction.on_commit(lambda: holder.changed(recipe_ids))
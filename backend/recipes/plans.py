@@ -0,0 +1,83 @@
+"""Проверка планов запросов API в Postgres.
+
+Сценарии benchmark_api выполняются на тестовой базе, и для каждого
+запроса к базе, который выполняет обработчик, снимается
+EXPLAIN (FORMAT JSON). План строится с enable_seqscan = off: так
+последовательное чтение в нём остаётся, только если ни один индекс
+не подходит, и проверка не зависит от размера тестовых данных.
+Последовательное чтение таблицы, в которой не меньше min_rows строк
+(по pg_class после ANALYZE), считается ошибкой, если таблицы нет
+в ALLOWED_SEQ_SCANS.
+"""
+from collections import namedtuple
+
+from django.db import connection
+
+from . import benchmark
+
+# Таблицы, которые можно читать целиком, и почему.
+ALLOWED_SEQ_SCANS = {}
+
+# Запросы, для которых строится план.
+EXPLAINED_PREFIXES = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+SeqScan = namedtuple('SeqScan', 'scenario table rows sql')
+
+
+def get_table_sizes():
+    """Число строк в таблицах по статистике Postgres."""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+        cursor.execute(
+            "SELECT relname, reltuples FROM pg_class "
+            "WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+        )
+        return {name: int(rows) for name, rows in cursor.fetchall()}
+
+
+def get_seq_scans(plan):
+    """Таблицы, которые план читает последовательно."""
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from get_seq_scans(child)
+
+
+class PlanCollector:
+    """Снимает план каждого запроса, который проходит через соединение."""
+
+    def __init__(self):
+        self.plans = []
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining or many or not sql.lstrip().upper().startswith(
+            EXPLAINED_PREFIXES
+        ):
+            return execute(sql, params, many, context)
+        self.explaining = True
+        try:
+            with context['connection'].cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                self.plans.append((sql, cursor.fetchone()[0][0]['Plan']))
+                cursor.execute('SET LOCAL enable_seqscan = on')
+        finally:
+            self.explaining = False
+        return execute(sql, params, many, context)
+
+
+def check(data, scenario, sizes, min_rows):
+    """Последовательные чтения больших таблиц в запросах сценария.
+
+    Первый запрос не проверяется: он прогревает кеши процесса.
+    """
+    benchmark.request(data, scenario)
+    collector = PlanCollector()
+    with connection.execute_wrapper(collector):
+        benchmark.request(data, scenario)
+    for sql, plan in collector.plans:
+        for table in get_seq_scans(plan):
+            rows = sizes.get(table, 0)
+            if rows >= min_rows and table not in ALLOWED_SEQ_SCANS:
+                yield SeqScan(scenario, table, rows, sql)
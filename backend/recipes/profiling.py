@@ -0,0 +1,201 @@
+"""Профилирование отдельных запросов по требованию сотрудника.
+
+Запрос от сотрудника с заголовком X-Profile или параметром ?profile=,
+равным 1 или true, выполняется под cProfile, все его SQL-запросы
+записываются с временем, а для SELECT после ответа снимаются планы
+EXPLAIN. Профиль сохраняется в settings.PROFILE_DIR (хранятся последние
+settings.PROFILE_KEEP), его id приходит в заголовке X-Profile-Id,
+а скачать его можно через /api/profiles/. Остальные запросы проверяются
+только на значение заголовка и параметра.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+HEADER = 'HTTP_X_PROFILE'
+QUERY_PARAM = 'profile'
+
+# Значения заголовка и параметра, которые включают профилирование.
+ENABLED_VALUES = ('1', 'true')
+
+# Сколько функций профиля попадает в текстовый отчёт.
+REPORT_FUNCTIONS = 60
+
+
+class QueryLog:
+    """SQL-запросы с параметрами и временем выполнения."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': None if many else params,
+                'many': many,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+
+    def explain(self):
+        """Добавляет к SELECT-запросам их планы."""
+        plans = {}
+        for query in self.queries:
+            if query['many'] or not query['sql'].lstrip().upper().startswith(
+                'SELECT'
+            ):
+                continue
+            key = (query['alias'], query['sql'], repr(query['params']))
+            if key not in plans:
+                plans[key] = get_plan(query)
+            query['plan'] = plans[key]
+
+
+def get_plan(query):
+    connection = connections[query['alias']]
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {query["sql"]}', query['params'])
+            return [
+                ' '.join(str(value) for value in row)
+                for row in cursor.fetchall()
+            ]
+    except Exception as error:
+        return [f'EXPLAIN failed: {error}']
+
+
+def is_requested(request):
+    """Просил ли запрос профилирование заголовком или параметром."""
+    values = (
+        request.META.get(HEADER, ''), request.GET.get(QUERY_PARAM, '')
+    )
+    return any(value.strip().lower() in ENABLED_VALUES for value in values)
+
+
+def get_staff_user(request):
+    """Сотрудник из сессии или токена, иначе None."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        header = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(header) != 2 or header[0] != 'Token':
+            return None
+        try:
+            user = TokenAuthentication().authenticate_credentials(header[1])[0]
+        except AuthenticationFailed:
+            return None
+    return user if user.is_staff else None
+
+
+def get_path(profile_id, extension):
+    return os.path.join(settings.PROFILE_DIR, f'{profile_id}.{extension}')
+
+
+def is_valid_id(profile_id):
+    return (
+        profile_id.replace('-', '').isalnum()
+        and os.path.exists(get_path(profile_id, 'json'))
+    )
+
+
+def list_profiles():
+    """Сохранённые профили, новые первыми."""
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    return sorted(
+        (
+            name[:-len('.json')] for name in os.listdir(settings.PROFILE_DIR)
+            if name.endswith('.json')
+        ),
+        reverse=True,
+    )
+
+
+def load(profile_id):
+    with open(get_path(profile_id, 'json'), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def prune():
+    for profile_id in list_profiles()[settings.PROFILE_KEEP:]:
+        for extension in ('json', 'prof'):
+            if os.path.exists(get_path(profile_id, extension)):
+                os.remove(get_path(profile_id, extension))
+
+
+def save(request, response, user, profiler, log, duration):
+    """Сохраняет профиль и SQL-журнал, возвращает id профиля."""
+    now = timezone.now()
+    profile_id = f'{now:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(get_path(profile_id, 'prof'))
+
+    functions = io.StringIO()
+    pstats.Stats(profiler, stream=functions).sort_stats(
+        'cumulative'
+    ).print_stats(REPORT_FUNCTIONS)
+    report = {
+        'id': profile_id,
+        'created': now.isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'user': user.get_username(),
+        'status': response.status_code,
+        'duration_ms': duration * 1000,
+        'sql_duration_ms': sum(
+            query['duration_ms'] for query in log.queries
+        ),
+        'queries': log.queries,
+        'functions': functions.getvalue(),
+    }
+    with open(get_path(profile_id, 'json'), 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2, default=str)
+    prune()
+    return profile_id
+
+
+class ProfilerMiddleware:
+    """Профилирует запросы сотрудников, которые об этом попросили."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_requested(request):
+            return self.get_response(request)
+        user = get_staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        log = QueryLog()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+        log.explain()
+        response['X-Profile-Id'] = save(
+            request, response, user, profiler, log, duration
+        )
+        return response
@@ -0,0 +1,112 @@
+"""Избранное, список покупок и подписки одним запросом к базе.
+
+Связи добавляются через INSERT ... ON CONFLICT DO NOTHING и удаляются
+через DELETE, оба с RETURNING: повтор запроса ничего не меняет,
+а счётчики меняются ровно на те строки, которые действительно
+добавились или удалились, даже при параллельных запросах.
+"""
+import sqlite3
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from . import counters
+from .models import Recipe
+
+User = get_user_model()
+
+# Модель связи, поле пользователя, поле объекта, модель объекта.
+RELATIONS = {
+    'favorite': (Recipe.favorite.through, 'user', 'recipe', Recipe),
+    'shopping_cart': (Recipe.cart.through, 'user', 'recipe', Recipe),
+    'subscribe': (User.subscribe.through, 'from_user', 'to_user', User),
+}
+
+
+def supports_returning():
+    """RETURNING есть в Postgres и в SQLite начиная с 3.35."""
+    return connection.vendor != 'sqlite' or (
+        sqlite3.sqlite_version_info >= (3, 35, 0)
+    )
+
+
+def get_linked(relation, user, obj_ids):
+    """id объектов из obj_ids, уже связанных с пользователем."""
+    model, user_field, obj_field, target = RELATIONS[relation]
+    return set(
+        model.objects.filter(
+            **{user_field: user.id, f'{obj_field}__in': obj_ids}
+        ).values_list(obj_field, flat=True)
+    )
+
+
+def execute(relation, user, obj_ids, sql, params, added):
+    """Выполняет запрос, возвращает id объектов, у которых связь менялась.
+
+    В старом SQLite без RETURNING связи сравниваются до и после запроса.
+    """
+    model, user_field, obj_field, target = RELATIONS[relation]
+    if not supports_returning():
+        before = get_linked(relation, user, obj_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+        after = get_linked(relation, user, obj_ids)
+        return sorted(after - before if added else before - after)
+
+    column = connection.ops.quote_name(model._meta.get_field(obj_field).column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {column}', params)
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def add(relation, user, obj_ids):
+    """Связывает пользователя с объектами, возвращает id новых связей.
+
+    Несуществующие объекты (и сам пользователь для подписки)
+    пропускаются.
+    """
+    model, user_field, obj_field, target = RELATIONS[relation]
+    obj_ids = list(obj_ids)
+    if not obj_ids:
+        return []
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    user_column = quote(model._meta.get_field(user_field).column)
+    obj_column = quote(model._meta.get_field(obj_field).column)
+    target_table = quote(target._meta.db_table)
+    sql = (
+        f'INSERT INTO {table} ({user_column}, {obj_column}) '
+        f'SELECT %s, id FROM {target_table} '
+        f'WHERE id IN ({", ".join(["%s"] * len(obj_ids))})'
+    )
+    params = [user.id, *obj_ids]
+    if relation == 'subscribe':
+        sql += ' AND id <> %s'
+        params.append(user.id)
+    sql += ' ON CONFLICT DO NOTHING'
+
+    with transaction.atomic():
+        added = execute(relation, user, obj_ids, sql, params, added=True)
+        counters.relation_changed(relation, added, 1)
+    return added
+
+
+def remove(relation, user, obj_ids):
+    """Убирает связи пользователя с объектами, возвращает id убранных."""
+    model, user_field, obj_field, target = RELATIONS[relation]
+    obj_ids = list(obj_ids)
+    if not obj_ids:
+        return []
+    quote = connection.ops.quote_name
+    sql = (
+        f'DELETE FROM {quote(model._meta.db_table)} '
+        f'WHERE {quote(model._meta.get_field(user_field).column)} = %s '
+        f'AND {quote(model._meta.get_field(obj_field).column)} '
+        f'IN ({", ".join(["%s"] * len(obj_ids))})'
+    )
+    with transaction.atomic():
+        removed = execute(
+            relation, user, obj_ids, sql, [user.id, *obj_ids], added=False
+        )
+        counters.relation_changed(relation, removed, -1)
+    return removed
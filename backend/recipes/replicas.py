@@ -0,0 +1,164 @@
+"""Чтение с реплик базы.
+
+ReplicaMiddleware разрешает читать с реплики запросам безопасными
+методами (GET, HEAD, OPTIONS); ReplicaRouter отправляет их чтения
+на одну из settings.DATABASE_REPLICAS, выбранную на весь запрос,
+а запись и всё, что выполняется вне HTTP-запросов (команды, фоновые
+потоки), — в основную базу. Токены всегда читаются из основной базы:
+только что выданный токен может ещё не дойти до реплики.
+
+Запрос, который что-то записал в основную базу (каким бы методом он
+ни был), дальше читает только из неё, а его пользователь ещё
+settings.REPLICA_PIN_SECONDS секунд читает из основной базы во всех
+воркерах — так он видит свои изменения, даже если реплика отстаёт.
+Закрепления хранятся в общем кэше settings.REPLICA_PIN_CACHE.
+Реплика, к которой не удалось подключиться, пропускается
+settings.REPLICA_RETRY_SECONDS секунд; если доступных реплик нет,
+читается основная база.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.authtoken.models import Token
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Запросы, после которых запрос считается пишущим.
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'COPY')
+
+# Сколько токенов помнить в процессе, чтобы не искать пользователя.
+TOKEN_CACHE_SIZE = 10000
+
+local = threading.local()
+
+# Реплика → время, до которого она считается недоступной.
+down_until = {}
+
+# Ключ токена → id пользователя.
+token_users = {}
+
+
+def is_available(alias):
+    if down_until.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        down_until[alias] = (
+            time.monotonic() + settings.REPLICA_RETRY_SECONDS
+        )
+        return False
+    down_until.pop(alias, None)
+    return True
+
+
+def choose_replica():
+    """Доступная реплика или основная база."""
+    replicas = list(settings.DATABASE_REPLICAS)
+    random.shuffle(replicas)
+    for alias in replicas:
+        if is_available(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def get_user_id(request):
+    """id пользователя по токену или сессии, без чтения с реплики."""
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) == 2 and header[0].lower() == 'token':
+        key = header[1]
+        if key not in token_users:
+            if len(token_users) >= TOKEN_CACHE_SIZE:
+                token_users.clear()
+            token_users[key] = Token.objects.filter(
+                key=key
+            ).values_list('user_id', flat=True).first()
+        return token_users[key]
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.id
+    return None
+
+
+def pin_key(user_id):
+    return f'replica_pin:{user_id}'
+
+
+def is_pinned(user_id):
+    """Писал ли пользователь в базу последние REPLICA_PIN_SECONDS секунд."""
+    return user_id is not None and caches[settings.REPLICA_PIN_CACHE].get(
+        pin_key(user_id)
+    ) is not None
+
+
+def pin(user_id):
+    caches[settings.REPLICA_PIN_CACHE].set(
+        pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS
+    )
+
+
+def detect_writes(execute, sql, params, many, context):
+    """Переводит запрос на основную базу после первой записи."""
+    if sql.lstrip().upper().startswith(WRITE_PREFIXES):
+        local.wrote = True
+        local.allowed = False
+    return execute(sql, params, many, context)
+
+
+class ReplicaMiddleware:
+    """Разрешает чтение с реплики и закрепляет писавших пользователей
+    за основной базой."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        local.wrote = False
+        local.alias = None
+        local.allowed = (
+            request.method in SAFE_METHODS
+            and not is_pinned(get_user_id(request))
+        )
+        try:
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(
+                detect_writes
+            ):
+                response = self.get_response(request)
+        finally:
+            local.allowed = False
+            local.alias = None
+        if local.wrote:
+            user_id = get_user_id(request)
+            if user_id is not None:
+                pin(user_id)
+        return response
+
+
+class ReplicaRouter:
+    """Чтение с реплики в разрешённых запросах, остальное —
+    в основную базу."""
+
+    def db_for_read(self, model, **hints):
+        if not getattr(local, 'allowed', False) or model is Token:
+            return DEFAULT_DB_ALIAS
+        # Внутри транзакции читаем то же, во что пишем.
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if local.alias is None:
+            local.alias = choose_replica()
+        return local.alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
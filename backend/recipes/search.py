@@ -0,0 +1,83 @@
+"""Полнотекстовый поиск рецептов.
+
+В Postgres у рецепта хранится поисковый вектор из названия, названий
+ингредиентов и описания (с весами A, B и C), по нему построен GIN-индекс.
+На остальных базах (SQLite в тестах) каждое слово запроса ищется
+регулярным выражением: в SQLite оно выполняется Python и, в отличие
+от LIKE, не различает регистр кириллицы.
+"""
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import (Case, F, IntegerField, OuterRef, Q, Subquery,
+                              Value, When)
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Ingredient, IngredientAmount, Recipe
+
+CONFIG = 'russian'
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def update_search_vectors(recipe_ids):
+    """Пересчитывает поисковые векторы рецептов."""
+    if not is_postgresql():
+        return
+    ingredient_names = IngredientAmount.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(
+        names=StringAgg('ingredients__name', ' ')
+    ).values('names')
+    Recipe.objects.filter(id__in=recipe_ids).update(
+        search_vector=(
+            SearchVector('name', weight='A', config=CONFIG)
+            + SearchVector(
+                Subquery(ingredient_names), weight='B', config=CONFIG
+            )
+            + SearchVector('text', weight='C', config=CONFIG)
+        )
+    )
+
+
+def search_recipes(queryset, text):
+    """Рецепты, подходящие под запрос, от более релевантных к менее."""
+    if is_postgresql():
+        query = SearchQuery(text, config=CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-pub_date')
+
+    words = [re.escape(word) for word in text.split()]
+    for word in words:
+        queryset = queryset.filter(
+            Q(name__iregex=word)
+            | Q(text__iregex=word)
+            | Q(id__in=IngredientAmount.objects.filter(
+                ingredients__name__iregex=word
+            ).values('recipe'))
+        )
+    return queryset.annotate(
+        rank=Case(
+            *(When(name__iregex=word, then=Value(1)) for word in words),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    ).order_by('-rank', '-pub_date')
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes(instance, created, **kwargs):
+    """Обновляет векторы рецептов при переименовании ингредиента."""
+    if not created:
+        update_search_vectors(
+            IngredientAmount.objects.filter(
+                ingredients=instance
+            ).values('recipe')
+        )
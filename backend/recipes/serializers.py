@@ -1,19 +1,55 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import transaction
+from django.utils import timezone
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
 from users.serializers import CustomUserSerializer
+from . import cart, catalog, counters, images, pantry, timeline, versions
 from .models import Ingredient, IngredientAmount, Recipe, Tag
+from .search import update_search_vectors
 
 User = get_user_model()
 
+# Сколько строк вставлять одним запросом при создании многих рецептов.
+BATCH_SIZE = 500
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit или None, если его нет."""
+    limit = request.query_params.get('recipes_limit', '')
+    if limit.isdecimal():
+        return int(limit)
+    return None
+
+
+class RecipeImagesField(serializers.Field):
+    """Ссылки на уменьшенные копии картинки рецепта."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        urls = images.get_urls(recipe)
+        request = self.context.get('request')
+        if request is None:
+            return urls
+        return {
+            name: request.build_absolute_uri(url)
+            for name, url in urls.items()
+        }
+
 
 class LiteRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели рецептов. С меньшим количеством полей."""
+    images = RecipeImagesField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
 
@@ -33,13 +69,23 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'name', 'measurement_unit')
 
 
+class IngredientAmountSerializer(serializers.ModelSerializer):
+    """Сериализатор для количества ингредиента в рецепте."""
+    id = serializers.ReadOnlyField(source='ingredients.id')
+    name = serializers.ReadOnlyField(source='ingredients.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredients.measurement_unit'
+    )
+
+    class Meta:
+        model = IngredientAmount
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+        read_only_fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
 class SubscribeSerializer(CustomUserSerializer):
     """Сериализатор для подписки."""
-    recipes = LiteRecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.IntegerField(
-        source='recipes.count',
-        read_only=True
-    )
+    recipes = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -58,15 +104,119 @@ class SubscribeSerializer(CustomUserSerializer):
     def get_is_subscribed(*args):
         return True
 
+    def get_recipes(self, obj):
+        """Последние рецепты автора, не больше recipes_limit."""
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
+        return LiteRecipeSerializer(
+            recipes, many=True, context=self.context
+        ).data
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Создание многих рецептов одной транзакцией."""
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data:
+            raise serializers.ValidationError(
+                'Ожидается непустой список рецептов'
+            )
+        limit = settings.RECIPE_BULK_CREATE_LIMIT
+        if len(data) > limit:
+            raise serializers.ValidationError(
+                f'Не больше {limit} рецептов за раз'
+            )
+
+        validated, errors = [], []
+        for item in data:
+            self.child.initial_data = item
+            try:
+                validated.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        names = [item['name'] for item in validated]
+        taken = set(Recipe.objects.filter(
+            author=validated[0]['author'], name__in=names
+        ).values_list('name', flat=True))
+        if taken or len(set(names)) != len(names):
+            raise serializers.ValidationError(
+                'Названия рецептов повторяются: '
+                f'{", ".join(sorted(taken or set(names)))}'
+            )
+        return validated
+
+    def create(self, validated_data):
+        author = validated_data[0]['author']
+        with transaction.atomic():
+            Recipe.objects.bulk_create(
+                (
+                    Recipe(**{
+                        key: value for key, value in item.items()
+                        if key not in ('tags', 'ingredients')
+                    }) for item in validated_data
+                ),
+                batch_size=BATCH_SIZE,
+            )
+            recipes = {
+                recipe.name: recipe for recipe in Recipe.objects.filter(
+                    author=author,
+                    name__in=[item['name'] for item in validated_data],
+                )
+            }
+            Recipe.tags.through.objects.bulk_create(
+                (
+                    Recipe.tags.through(
+                        recipe_id=recipes[item['name']].id, tag_id=tag
+                    )
+                    for item in validated_data
+                    for tag in {int(tag) for tag in item['tags']}
+                ),
+                batch_size=BATCH_SIZE,
+            )
+            IngredientAmount.objects.bulk_create(
+                (
+                    IngredientAmount(
+                        recipe=recipes[item['name']],
+                        ingredients=ingredient['ingredient'],
+                        amount=ingredient['amount'],
+                    )
+                    for item in validated_data
+                    for ingredient in item['ingredients']
+                ),
+                batch_size=BATCH_SIZE,
+            )
+            update_search_vectors([recipe.id for recipe in recipes.values()])
+            timeline.fan_out(recipe.id for recipe in recipes.values())
+            pantry.recipes_changed(recipe.id for recipe in recipes.values())
+            versions.bump(versions.RECIPES)
+            counters.change(
+                User, (author.id,), 'recipes_count', len(recipes)
+            )
+            for recipe in recipes.values():
+                images.schedule(recipe)
+        return [recipes[item['name']] for item in validated_data]
+
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели рецептов."""
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
-    ingredients = serializers.SerializerMethodField()
+    ingredients = IngredientAmountSerializer(
+        source='ingredient', many=True, read_only=True
+    )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    images = RecipeImagesField()
 
     class Meta:
         model = Recipe
@@ -79,23 +229,20 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
         )
         read_only_fields = ('is_favorite', 'is_shopping_cart', )
-
-    def get_ingredients(self, obj):
-        """Получение списка ингредиентов."""
-        return obj.ingredients.values(
-            'id', 'name', 'measurement_unit',
-            amount=models.F('recipe__amount')
-        )
+        list_serializer_class = RecipeListSerializer
 
     def get_is_favorited(self, obj):
         """Проверка на наличие рецепта в избранном."""
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return user.favorites.filter(id=obj.id).exists()
 
     def get_is_in_shopping_cart(self, obj):
@@ -103,6 +250,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return user.carts.filter(id=obj.id).exists()
 
     def create_ingredients(self, ingredients, recipe):
@@ -114,31 +263,22 @@ class RecipeSerializer(serializers.ModelSerializer):
         ) for ingredient in ingredients)
         IngredientAmount.objects.bulk_create(objs)
 
-    def validate(self, data):
-        """Проверка данных."""
-        name = str(self.initial_data.get('name')).strip()
-        tags = self.initial_data.get('tags')
-        ingredients = self.initial_data.get('ingredients')
-        values_list = (tags, ingredients)
-
-        for value in values_list:
-            if not isinstance(value, list):
-                raise serializers.ValidationError(
-                    f'"{value}" должен быть в формате "[]"'
-                )
-
+    def check_tags(self, tags):
+        """Проверяет id тегов, все сразу одним запросом."""
         for tag in tags:
             if not str(tag).isdecimal():
                 raise serializers.ValidationError(
                     f'{tag} должно состоять из цифр'
                 )
-
-            if not Tag.objects.filter(id=tag):
+        known_tags = catalog.resolve(Tag, {int(tag) for tag in tags})
+        for tag in tags:
+            if int(tag) not in known_tags:
                 raise serializers.ValidationError(
                     f'{tag} не существует'
                 )
 
-        valid_ingredients = []
+    def check_ingredients(self, ingredients):
+        """Проверяет ингредиенты, все сразу одним запросом."""
         for ingredient_item in ingredients:
             ingredient_id = ingredient_item.get('id')
             if not str(ingredient_id).isdecimal() or str(ingredient_id) == '0':
@@ -146,12 +286,20 @@ class RecipeSerializer(serializers.ModelSerializer):
                     f'Убедитесь, что значение {ingredient_id} '
                     f'является числом больше 0'
                 )
+        ingredient_ids = [int(item.get('id')) for item in ingredients]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться'
+            )
+        known_ingredients = catalog.resolve(Ingredient, ingredient_ids)
 
-            if not Ingredient.objects.filter(id=ingredient_id):
+        valid_ingredients = []
+        for ingredient_id, ingredient_item in zip(ingredient_ids, ingredients):
+            ingredient = known_ingredients.get(ingredient_id)
+            if ingredient is None:
                 raise serializers.ValidationError(
                     f'{ingredient_id} не существует'
                 )
-            ingredient = Ingredient.objects.filter(id=ingredient_id)[0]
 
             amount = ingredient_item.get('amount')
             if not str(amount).isdecimal() or str(amount) == '0':
@@ -163,10 +311,25 @@ class RecipeSerializer(serializers.ModelSerializer):
             valid_ingredients.append(
                 {'ingredient': ingredient, 'amount': amount}
             )
+        return valid_ingredients
+
+    def validate(self, data):
+        """Проверка данных."""
+        name = str(self.initial_data.get('name')).strip()
+        tags = self.initial_data.get('tags')
+        ingredients = self.initial_data.get('ingredients')
+        values_list = (tags, ingredients)
+
+        for value in values_list:
+            if not isinstance(value, list):
+                raise serializers.ValidationError(
+                    f'"{value}" должен быть в формате "[]"'
+                )
 
+        self.check_tags(tags)
         data['name'] = name.capitalize()
         data['tags'] = tags
-        data['ingredients'] = valid_ingredients
+        data['ingredients'] = self.check_ingredients(ingredients)
         data['author'] = self.context.get('request').user
         return data
 
@@ -175,32 +338,98 @@ class RecipeSerializer(serializers.ModelSerializer):
         image = validated_data.pop('image')
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(image=image, **validated_data)
-        recipe.tags.set(tags)
-        self.create_ingredients(ingredients, recipe)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(image=image, **validated_data)
+            recipe.tags.set(tags)
+            self.create_ingredients(ingredients, recipe)
+            update_search_vectors((recipe.id,))
+            timeline.fan_out((recipe.id,))
+            pantry.recipes_changed((recipe.id,))
+            counters.change(User, (recipe.author_id,), 'recipes_count', 1)
+            images.schedule(recipe)
         return recipe
 
+    def update_tags(self, recipe, tags):
+        """Добавляет новые и удаляет убранные теги, True если были."""
+        links = Recipe.tags.through.objects.filter(recipe=recipe)
+        old = set(links.values_list('tag_id', flat=True))
+        new = {int(tag) for tag in tags}
+        if old - new:
+            links.filter(tag_id__in=old - new).delete()
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag_id=tag)
+            for tag in new - old
+        )
+        return old != new
+
+    def update_ingredients(self, recipe, ingredients):
+        """Пишет разницу в количестве ингредиентов.
+
+        Возвращает (изменилось ли количество, изменился ли состав).
+        """
+        rows = {
+            row.ingredients_id: row
+            for row in IngredientAmount.objects.filter(recipe=recipe)
+        }
+        new = {
+            item['ingredient'].id: int(item['amount'])
+            for item in ingredients
+        }
+        changed = [
+            rows[pk] for pk, amount in new.items()
+            if pk in rows and rows[pk].amount != amount
+        ]
+        old_amounts = {pk: row.amount for pk, row in rows.items()}
+        for row in changed:
+            row.amount = new[row.ingredients_id]
+        removed = set(rows) - set(new)
+        added = set(new) - set(rows)
+
+        if removed:
+            IngredientAmount.objects.filter(
+                recipe=recipe, ingredients__in=removed
+            ).delete()
+        IngredientAmount.objects.bulk_update(changed, ('amount',))
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredients_id=pk, amount=new[pk])
+            for pk in added
+        )
+        if changed or removed or added:
+            cart.recipe_changed(recipe.id, old_amounts)
+        return bool(changed or removed or added), bool(removed or added)
+
     def update(self, recipe, validated_data):
-        """Обновление рецепта."""
+        """Обновление рецепта: пишутся только изменившиеся строки."""
         tags = validated_data.get('tags')
         ingredients = validated_data.get('ingredients')
-
-        recipe.image = validated_data.get(
-            'image', recipe.image)
-        recipe.name = validated_data.get(
-            'name', recipe.name)
-        recipe.text = validated_data.get(
-            'text', recipe.text)
-        recipe.cooking_time = validated_data.get(
-            'cooking_time', recipe.cooking_time)
-
-        if tags:
-            recipe.tags.clear()
-            recipe.tags.set(tags)
-
-        if ingredients:
-            recipe.ingredients.clear()
-            self.create_ingredients(ingredients, recipe)
-
-        recipe.save()
+        fields = [
+            field for field in ('image', 'name', 'text', 'cooking_time')
+            if field in validated_data and (
+                field == 'image'
+                or getattr(recipe, field) != validated_data[field]
+            )
+        ]
+
+        with transaction.atomic():
+            for field in fields:
+                setattr(recipe, field, validated_data[field])
+            tags_changed = bool(tags) and self.update_tags(recipe, tags)
+            amounts_changed, composition_changed = (
+                self.update_ingredients(recipe, ingredients)
+                if ingredients else (False, False)
+            )
+            if fields:
+                recipe.save(update_fields=(*fields, 'updated_at'))
+            elif tags_changed or amounts_changed:
+                recipe.updated_at = timezone.now()
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    updated_at=recipe.updated_at
+                )
+                versions.bump(versions.RECIPES)
+            if composition_changed or {'name', 'text'} & set(fields):
+                update_search_vectors((recipe.id,))
+            if composition_changed:
+                pantry.recipes_changed((recipe.id,))
+            if 'image' in fields:
+                images.schedule(recipe)
         return recipe
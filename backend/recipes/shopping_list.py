@@ -0,0 +1,235 @@
+"""Выгрузка списка покупок в форматах TXT, CSV и PDF.
+
+TXT и CSV отдаются потоком и кэшируются в общем для воркеров кэше
+shopping_lists по базе, версии каталога (названия и единицы
+ингредиентов) и версии списка покупок, если файл не больше
+settings.SHOPPING_LIST_CACHE_MAX_SIZE: больший файл не держится
+в памяти целиком. Заголовок с датой в кэш не попадает. PDF
+не кэшируется: дата выгрузки в нём внутри документа.
+"""
+import csv
+import io
+from datetime import datetime as dt
+from hashlib import md5
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
+from django.http.response import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from . import catalog
+from .models import CartIngredient
+
+# Сколько строк читать из курсора и отдавать клиенту за раз.
+CHUNK_SIZE = 500
+# Сколько хранить готовый файл для одной версии списка покупок.
+CACHE_TIMEOUT = 60 * 60
+
+CACHE = 'shopping_lists'
+
+
+def get_ingredients(user):
+    """Ингредиенты из списка покупок пользователя."""
+    return CartIngredient.objects.filter(
+        user=user
+    ).values(
+        'amount',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+    ).order_by('name')
+
+
+def get_title():
+    return f'Список покупок от {dt.now().strftime("%d.%m.%Y, %H:%M")}'
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    """Склеивает строки в блоки, чтобы не отдавать их по одной."""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+class TextRenderer:
+    """Список покупок обычным текстом."""
+    extension = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+    cacheable = True
+
+    def head(self, title):
+        return (title,)
+
+    def lines(self, ingredients):
+        for item in ingredients:
+            yield (
+                f'\n- {item["name"]}: '
+                f'{item["amount"]} {item["measurement_unit"]}'
+            )
+
+    def body(self, ingredients):
+        return chunked(self.lines(ingredients))
+
+    def render(self, ingredients, title):
+        return chain(self.head(title), self.body(ingredients))
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу возвращает записанное."""
+
+    def write(self, value):
+        return value
+
+
+class CsvRenderer:
+    """Список покупок в CSV."""
+    extension = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+    header = ('ингредиент', 'количество', 'единица измерения')
+    cacheable = True
+
+    def lines(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header)
+        for item in ingredients:
+            yield writer.writerow(
+                (item['name'], item['amount'], item['measurement_unit'])
+            )
+
+    def head(self, title):
+        return ()
+
+    def body(self, ingredients):
+        return chunked(self.lines(ingredients))
+
+    def render(self, ingredients, title):
+        return self.body(ingredients)
+
+
+class PdfRenderer:
+    """Список покупок в PDF.
+
+    reportlab собирает документ целиком, поэтому страницы отдаются
+    после построения, но строки всё равно читаются из курсора порциями.
+    """
+    extension = 'pdf'
+    content_type = 'application/pdf'
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+    line_height = 18
+    cacheable = False
+
+    def register_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_PDF_FONT)
+            )
+
+    def build(self, ingredients, title):
+        self.register_font()
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        height = A4[1]
+        pdf.setTitle(title)
+        pdf.setFont(self.font_name, self.font_size)
+        y = height - self.margin
+        pdf.drawString(self.margin, y, title)
+        y -= self.line_height * 2
+        for item in ingredients:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            pdf.drawString(
+                self.margin, y,
+                f'- {item["name"]}: '
+                f'{item["amount"]} {item["measurement_unit"]}'
+            )
+            y -= self.line_height
+        pdf.save()
+        buffer.seek(0)
+        return buffer
+
+    def render(self, ingredients, title):
+        buffer = self.build(ingredients, title)
+        yield from iter(lambda: buffer.read(64 * 1024), b'')
+
+
+RENDERERS = {
+    renderer.extension: renderer
+    for renderer in (TextRenderer(), CsvRenderer(), PdfRenderer())
+}
+
+
+def cache_chunks(chunks, key):
+    """Отдаёт части файла и кладёт файл в кэш, когда он собран целиком,
+    если он не больше SHOPPING_LIST_CACHE_MAX_SIZE."""
+    rendered, size = [], 0
+    for chunk in chunks:
+        if rendered is not None:
+            size += len(chunk)
+            rendered.append(chunk)
+            if size > settings.SHOPPING_LIST_CACHE_MAX_SIZE:
+                rendered = None
+        yield chunk
+    if rendered is not None:
+        caches[CACHE].set(key, ''.join(rendered), CACHE_TIMEOUT)
+
+
+def get_cache_key(user, renderer):
+    """Ключ файла: база, версия каталога, пользователь и его корзина.
+
+    Версия каталога берётся из снимка процесса: после переименования
+    ингредиента старый файл может отдаваться ещё до
+    CATALOG_CHECK_INTERVAL секунд, как и сам каталог.
+    """
+    database = connection.settings_dict
+    database = md5(
+        f'{database["HOST"]}:{database["PORT"]}:{database["NAME"]}'.encode()
+    ).hexdigest()[:12]
+    return (
+        f'shopping_list:{database}:{catalog.get().version}:'
+        f'{user.id}:{user.cart_version}:{renderer.extension}'
+    )
+
+
+def get_content(user, renderer, title):
+    """Части файла: тело из кэша или из базы."""
+    if not renderer.cacheable:
+        ingredients = get_ingredients(user).iterator(chunk_size=CHUNK_SIZE)
+        return renderer.render(ingredients, title)
+    key = get_cache_key(user, renderer)
+    body = caches[CACHE].get(key)
+    if body is not None:
+        return chain(renderer.head(title), (body,))
+    ingredients = get_ingredients(user).iterator(chunk_size=CHUNK_SIZE)
+    return chain(
+        renderer.head(title), cache_chunks(renderer.body(ingredients), key)
+    )
+
+
+def shopping_list_response(user, renderer):
+    """Ответ с файлом списка покупок.
+
+    Небольшой файл кэшируется по версии списка покупок пользователя,
+    поэтому повторная выгрузка не трогает базу, пока корзина
+    не изменилась.
+    """
+    response = StreamingHttpResponse(
+        get_content(user, renderer, get_title()),
+        content_type=renderer.content_type,
+    )
+    filename = f'{user.username}_shopping_list.{renderer.extension}'
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
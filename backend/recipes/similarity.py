@@ -0,0 +1,268 @@
+"""Похожие рецепты по общим ингредиентам, посчитанные заранее.
+
+Рецепты — строки разреженной матрицы рецепт × ингредиент из
+IngredientAmount: у каждого ингредиента хранится массив рецептов
+(столбец), у каждого рецепта — массив ингредиентов (строка).
+Пересечения рецепта со всеми остальными считаются одним проходом
+по столбцам его ингредиентов, сходство — по Жаккару или косинусом,
+с добавкой за общие теги. Лучшие settings.SIMILAR_RECIPES_TOP
+рецептов пишутся в RecipeSimilarity.
+
+Ингредиенты, которые есть больше чем в max_recipes рецептах (соль,
+вода), не порождают кандидатов — иначе каждый рецепт сравнивался бы
+почти со всеми, — но входят в пересечение найденных кандидатов: они,
+как и теги, хранятся у рецепта битовой маской.
+
+Без флага full пересчитываются только рецепты, изменённые после
+прошлого расчёта (updated_at > similar_computed_at), и те, в чьих
+списках они были или могут теперь оказаться. Если удалённый рецепт
+оставил в чужих списках меньше строк, их дополнит полный пересчёт.
+"""
+import heapq
+import math
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .dataset import RowWriter
+from .importers import batched
+from .models import IngredientAmount, Recipe, RecipeSimilarity
+from .search import is_postgresql
+
+METRICS = {
+    'jaccard': lambda common, size, other: common / (size + other - common),
+    'cosine': lambda common, size, other: common / math.sqrt(size * other),
+}
+
+
+def bit_count(mask):
+    return bin(mask).count('1')
+
+
+class SimilarityBuilder:
+    """Расчёт похожих рецептов для всех или изменившихся рецептов."""
+
+    def __init__(self, metric='cosine', tag_weight=0.5, top=None,
+                 max_recipes=1000, batch_size=1000, report=None):
+        self.metric = METRICS[metric]
+        self.tag_weight = tag_weight
+        self.top = top or settings.SIMILAR_RECIPES_TOP
+        self.max_recipes = max_recipes
+        self.batch_size = batch_size
+        self.writer = RowWriter(use_copy=is_postgresql())
+        self.report = report or (lambda *args: None)
+
+    def load(self):
+        """Читает матрицу рецепт × ингредиент и теги рецептов."""
+        columns = defaultdict(list)
+        rows = defaultdict(list)
+        for ingredient_id, recipe_id in IngredientAmount.objects.order_by(
+            'ingredients', 'recipe'
+        ).values_list('ingredients', 'recipe').iterator():
+            columns[ingredient_id].append(recipe_id)
+            rows[recipe_id].append(ingredient_id)
+        hubs = {
+            ingredient_id: 1 << number
+            for number, ingredient_id in enumerate(sorted(
+                ingredient_id for ingredient_id, recipe_ids in columns.items()
+                if len(recipe_ids) > self.max_recipes
+            ))
+        }
+        self.columns = {
+            ingredient_id: array('q', recipe_ids)
+            for ingredient_id, recipe_ids in columns.items()
+            if ingredient_id not in hubs
+        }
+        self.sizes = {
+            recipe_id: len(ingredients)
+            for recipe_id, ingredients in rows.items()
+        }
+        self.shortest = min(self.sizes.values(), default=1)
+        self.rows = {
+            recipe_id: array('q', (
+                pk for pk in ingredients if pk not in hubs
+            ))
+            for recipe_id, ingredients in rows.items()
+        }
+        self.hubs = {
+            recipe_id: sum(hubs.get(pk, 0) for pk in ingredients)
+            for recipe_id, ingredients in rows.items()
+        }
+        self.tags = defaultdict(int)
+        if self.tag_weight:
+            bits = {}
+            for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+                'recipe', 'tag'
+            ).iterator():
+                bit = bits.setdefault(tag_id, 1 << len(bits))
+                self.tags[recipe_id] |= bit
+
+    def get_common(self, recipe_id):
+        """Число общих неосновных ингредиентов с каждым кандидатом."""
+        common = Counter()
+        for ingredient_id in self.rows.get(recipe_id, ()):
+            common.update(self.columns[ingredient_id])
+        common.pop(recipe_id, None)
+        return common
+
+    def get_scorer(self, recipe_id):
+        """Функция сходства рецепта с кандидатом по числу общих
+        неосновных ингредиентов.
+
+        Вклад общих основных ингредиентов и тегов зависит только от
+        пересечения масок, поэтому считается один раз на маску.
+        """
+        metric, sizes, hubs, tags = (
+            self.metric, self.sizes, self.hubs, self.tags
+        )
+        size = sizes[recipe_id]
+        recipe_hubs, recipe_tags = hubs[recipe_id], tags[recipe_id]
+        overlaps, factors = {}, {}
+
+        def get_factor(other_tags):
+            if not recipe_tags or not other_tags:
+                return 1
+            return 1 + self.tag_weight * (
+                bit_count(recipe_tags & other_tags)
+                / bit_count(recipe_tags | other_tags)
+            )
+
+        def score(other_id, count):
+            common = recipe_hubs & hubs[other_id]
+            if common not in overlaps:
+                overlaps[common] = bit_count(common)
+            other_tags = tags[other_id]
+            if other_tags not in factors:
+                factors[other_tags] = get_factor(other_tags)
+            return metric(
+                count + overlaps[common], size, sizes[other_id]
+            ) * factors[other_tags]
+        return score
+
+    def get_scores(self, recipe_id):
+        """Сходство рецепта со всеми рецептами, у которых есть общее.
+
+        У рецепта без ингредиентов похожих нет.
+        """
+        if recipe_id not in self.sizes:
+            return {}
+        score = self.get_scorer(recipe_id)
+        return {
+            other_id: score(other_id, count)
+            for other_id, count in self.get_common(recipe_id).items()
+        }
+
+    def get_top(self, recipe_id):
+        """Лучшие похожие рецепты без подсчёта сходства со всеми.
+
+        Кандидаты перебираются от большего числа общих ингредиентов
+        к меньшему и отбрасываются, когда даже с общими основными
+        ингредиентами, самым коротким составом и всеми общими тегами
+        они не обойдут худший из уже найденных.
+        """
+        common = self.get_common(recipe_id)
+        if not common:
+            return []
+        score = self.get_scorer(recipe_id)
+        size = self.sizes[recipe_id]
+        hubs = bit_count(self.hubs[recipe_id])
+        bonus = 1 + self.tag_weight
+        top = []
+        bounds = {}
+        for other_id, count in common.most_common():
+            if len(top) == self.top:
+                if count not in bounds:
+                    bounds[count] = self.metric(
+                        count + hubs, size, max(self.shortest, count + hubs)
+                    ) * bonus
+                if bounds[count] < top[0][0]:
+                    break
+            item = (score(other_id, count), -other_id)
+            if len(top) < self.top:
+                heapq.heappush(top, item)
+            elif item > top[0]:
+                heapq.heapreplace(top, item)
+        return [
+            (-other_id, value) for value, other_id in sorted(top, reverse=True)
+        ]
+
+    def get_thresholds(self):
+        """Сходство, которое нужно превзойти, чтобы попасть в список."""
+        return {
+            row['recipe']: row['lowest'] if row['count'] >= self.top else 0
+            for row in RecipeSimilarity.objects.values('recipe').annotate(
+                lowest=Min('score'), count=Count('id')
+            ).order_by()
+        }
+
+    def store(self, tops, computed_at):
+        recipe_ids = list(tops)
+        with transaction.atomic():
+            RecipeSimilarity.objects.filter(recipe__in=recipe_ids).delete()
+            self.writer.write(
+                RecipeSimilarity, ('recipe', 'similar', 'score'), (
+                    (recipe_id, similar_id, score)
+                    for recipe_id, top in tops.items()
+                    for similar_id, score in top
+                )
+            )
+            Recipe.objects.filter(id__in=recipe_ids).update(
+                similar_computed_at=computed_at
+            )
+
+    def compute(self, recipe_ids, computed_at, thresholds=None):
+        """Считает и пишет списки рецептов пачками.
+
+        С thresholds возвращает рецепты, в чьи списки могут войти
+        посчитанные.
+        """
+        affected = set()
+        done = 0
+        for batch in batched(recipe_ids, self.batch_size):
+            tops = {}
+            for recipe_id in batch:
+                if thresholds is None:
+                    tops[recipe_id] = self.get_top(recipe_id)
+                    continue
+                scores = self.get_scores(recipe_id)
+                tops[recipe_id] = heapq.nlargest(
+                    self.top, scores.items(),
+                    key=lambda item: (item[1], -item[0])
+                )
+                affected.update(
+                    other_id for other_id, score in scores.items()
+                    if score > thresholds.get(other_id, 0)
+                )
+            self.store(tops, computed_at)
+            done += len(batch)
+            self.report(done, len(recipe_ids))
+        return affected
+
+    def run(self, full=False):
+        """Пересчитывает похожие рецепты, возвращает число рецептов."""
+        computed_at = timezone.now()
+        recipes = Recipe.objects.all()
+        if not full:
+            recipes = recipes.filter(
+                Q(similar_computed_at__isnull=True)
+                | Q(similar_computed_at__lt=F('updated_at'))
+            )
+        changed = list(recipes.order_by('id').values_list('id', flat=True))
+        if not changed:
+            return 0
+        self.load()
+        if full:
+            self.compute(changed, computed_at)
+            return len(changed)
+
+        affected = set(RecipeSimilarity.objects.filter(
+            similar__in=recipes.values('id')
+        ).values_list('recipe', flat=True))
+        affected |= self.compute(changed, computed_at, self.get_thresholds())
+        affected = sorted(affected.difference(changed))
+        self.compute(affected, computed_at)
+        return len(changed) + len(affected)
@@ -0,0 +1,237 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+У каждого читателя есть таблица TimelineEntry с рецептами его авторов.
+Новый рецепт раскладывается по лентам всех подписчиков одним
+INSERT ... SELECT (fan-out on write), при подписке в ленту копируются
+последние settings.TIMELINE_BACKFILL рецептов автора, при отписке они
+удаляются.
+
+Рецепты авторов, у которых больше settings.TIMELINE_FANOUT_LIMIT
+подписчиков, по лентам не раскладываются: при чтении они берутся
+из Recipe по индексу (author, pub_date, id) и сливаются с лентой
+(fan-out on read). Когда такой автор теряет подписчиков и опускается
+до порога, его последние рецепты раскладываются по лентам заново —
+в фоновом потоке после ответа, пачками по BACKFILL_BATCH подписчиков;
+после reconcile_counters и правок подписок в админке ленты
+пересобирает команда rebuild_timelines.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Recipe, TimelineEntry
+
+User = get_user_model()
+
+Subscription = User.subscribe.through
+
+logger = logging.getLogger(__name__)
+
+# Скольким подписчикам заполнять ленты одним запросом в фоне.
+BACKFILL_BATCH = 500
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_columns():
+    quote = connection.ops.quote_name
+    return ', '.join(
+        quote(TimelineEntry._meta.get_field(name).column)
+        for name in ('user', 'recipe', 'author', 'pub_date')
+    )
+
+
+def get_tables():
+    quote = connection.ops.quote_name
+    return {
+        'timeline': quote(TimelineEntry._meta.db_table),
+        'recipe': quote(Recipe._meta.db_table),
+        'user': quote(User._meta.db_table),
+        'subscription': quote(Subscription._meta.db_table),
+    }
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def insert(select_sql, params):
+    """Добавляет в ленты строки (читатель, рецепт, автор, дата)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {get_tables()["timeline"]} ({get_columns()}) '
+            f'{select_sql} ON CONFLICT DO NOTHING',
+            params
+        )
+
+
+def fan_out(recipe_ids):
+    """Раскладывает новые рецепты по лентам подписчиков их авторов."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    tables = get_tables()
+    insert(
+        f'SELECT s.from_user_id, r.id, r.author_id, r.pub_date '
+        f'FROM {tables["recipe"]} r '
+        f'JOIN {tables["user"]} a ON a.id = r.author_id '
+        f'JOIN {tables["subscription"]} s ON s.to_user_id = r.author_id '
+        f'WHERE r.id IN ({placeholders(recipe_ids)}) '
+        f'AND a.followers_count <= %s',
+        [*recipe_ids, settings.TIMELINE_FANOUT_LIMIT]
+    )
+
+
+def backfill(user_ids=None, author_ids=None):
+    """Копирует в ленты последние рецепты авторов по подпискам.
+
+    Берутся подписки читателей user_ids на авторов author_ids (None —
+    без ограничения); авторы выше порога пропускаются.
+    """
+    tables = get_tables()
+    conditions, params = [], []
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        conditions.append(f's.from_user_id IN ({placeholders(user_ids)})')
+        params.extend(user_ids)
+    if author_ids is not None:
+        author_ids = list(author_ids)
+        if not author_ids:
+            return
+        conditions.append(f's.to_user_id IN ({placeholders(author_ids)})')
+        params.extend(author_ids)
+    where = ' AND '.join(conditions) or '1 = 1'
+    insert(
+        f'SELECT s.from_user_id, r.id, r.author_id, r.pub_date '
+        f'FROM {tables["subscription"]} s '
+        f'JOIN {tables["user"]} a ON a.id = s.to_user_id '
+        f'JOIN (SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+        f'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+        f') AS "row_number" FROM {tables["recipe"]} WHERE author_id IN ('
+        f'SELECT s.to_user_id FROM {tables["subscription"]} s '
+        f'WHERE {where})) r ON r.author_id = s.to_user_id '
+        f'WHERE {where} AND a.followers_count <= %s '
+        f'AND r."row_number" <= %s',
+        [
+            *params, *params, settings.TIMELINE_FANOUT_LIMIT,
+            settings.TIMELINE_BACKFILL,
+        ]
+    )
+
+
+def subscribed(user, author_ids):
+    """Заполняет ленту рецептами новых авторов пользователя."""
+    if author_ids:
+        backfill((user.id,), author_ids)
+
+
+def backfill_followers(author_ids):
+    """Заполняет ленты всех подписчиков авторов пачками."""
+    for author_id in author_ids:
+        followers = list(Subscription.objects.filter(
+            to_user=author_id
+        ).order_by('from_user').values_list('from_user', flat=True))
+        for start in range(0, len(followers), BACKFILL_BATCH):
+            backfill(followers[start:start + BACKFILL_BATCH], (author_id,))
+
+
+def run_backfill(author_ids):
+    try:
+        backfill_followers(author_ids)
+    except Exception:
+        logger.exception('Не удалось заполнить ленты авторов %s', author_ids)
+    finally:
+        connection.close()
+
+
+def submit(*args):
+    """Отдаёт задачу фоновому потоку, создавая его при первом вызове."""
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='timelines'
+            )
+        executor.submit(*args)
+
+
+def schedule_backfill(author_ids):
+    """Ставит заполнение лент подписчиков в очередь после коммита.
+
+    При TIMELINE_BACKFILL_IN_BACKGROUND = False ленты заполняются сразу
+    после коммита.
+    """
+    author_ids = list(author_ids)
+    if settings.TIMELINE_BACKFILL_IN_BACKGROUND:
+        transaction.on_commit(lambda: submit(run_backfill, author_ids))
+    else:
+        transaction.on_commit(lambda: backfill_followers(author_ids))
+
+
+def unsubscribed(user, author_ids):
+    """Убирает из ленты рецепты авторов, от которых отписались.
+
+    Авторы, опустившиеся до порога, снова раскладываются по лентам
+    после ответа.
+    """
+    if not author_ids:
+        return
+    TimelineEntry.objects.filter(user=user, author__in=author_ids).delete()
+    demoted = list(User.objects.filter(
+        id__in=author_ids, followers_count=settings.TIMELINE_FANOUT_LIMIT
+    ).values_list('id', flat=True))
+    if demoted:
+        schedule_backfill(demoted)
+
+
+def rebuild(user_ids):
+    """Пересобирает ленты пользователей с нуля."""
+    user_ids = list(user_ids)
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user__in=user_ids).delete()
+        backfill(user_ids)
+
+
+def before(queryset, pub_date, pk, id_field):
+    """Строки после курсора (pub_date, pk) при порядке от новых к старым."""
+    if pub_date is not None:
+        queryset = queryset.filter(
+            Q(pub_date__lte=pub_date),
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, **{
+                f'{id_field}__lt': pk
+            })
+        )
+    return queryset.order_by('-pub_date', f'-{id_field}').values_list(
+        'pub_date', id_field
+    )
+
+
+def get_keys(user, pub_date, pk, count):
+    """До count ключей (pub_date, id) рецептов ленты после курсора."""
+    keys = set(before(
+        TimelineEntry.objects.filter(user=user), pub_date, pk, 'recipe'
+    )[:count])
+    popular = list(Subscription.objects.filter(
+        from_user=user,
+        to_user__followers_count__gt=settings.TIMELINE_FANOUT_LIMIT,
+    ).values_list('to_user', flat=True))
+    if popular:
+        keys.update(before(
+            Recipe.objects.filter(author__in=popular), pub_date, pk, 'id'
+        )[:count])
+    return sorted(keys, reverse=True)[:count]
+
+
+def get_recipes(user, queryset, pub_date, pk, count):
+    """До count рецептов ленты после курсора, от новых к старым."""
+    ids = [recipe_id for _, recipe_id in get_keys(user, pub_date, pk, count)]
+    recipes = queryset.in_bulk(ids)
+    return [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes]
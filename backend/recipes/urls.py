@@ -3,7 +3,7 @@ from rest_framework import routers
 
 from users.views import UserViewSet
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+from .views import IngredientViewSet, ProfileViewSet, RecipeViewSet, TagViewSet
 
 app_name = 'recipes'
 
@@ -12,6 +12,7 @@ router_v1.register('tags', TagViewSet, 'tags')
 router_v1.register('ingredients', IngredientViewSet, 'ingredients')
 router_v1.register('recipes', RecipeViewSet, 'recipes')
 router_v1.register('users', UserViewSet, 'users')
+router_v1.register('profiles', ProfileViewSet, 'profiles')
 
 urlpatterns = (
     path('', include(router_v1.urls)),
@@ -0,0 +1,81 @@
+"""Версии данных для условных запросов и сброса кешей.
+
+Версия каталога (теги и ингредиенты) хранится в DataVersion и растёт
+при каждом изменении каталога: через сигналы моделей или явно из команд
+загрузки, которые пишут в обход сигналов. Так же растёт версия
+рецептов RECIPES — из неё строится ETag списка рецептов.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Max, Subquery
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import DataVersion, Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+CATALOG = 'catalog'
+RECIPES = 'recipes'
+
+
+def get(name=CATALOG):
+    """Версия данных и время её изменения."""
+    row = DataVersion.objects.filter(name=name).values_list(
+        'version', 'updated_at'
+    ).first()
+    return row or (0, None)
+
+
+def get_many(*names):
+    """Версии нескольких данных одним запросом."""
+    rows = dict(DataVersion.objects.filter(name__in=names).values_list(
+        'name', 'version'
+    ))
+    return tuple(rows.get(name, 0) for name in names)
+
+
+def bump(name=CATALOG):
+    """Увеличивает версию данных."""
+    updated = DataVersion.objects.filter(name=name).update(
+        version=F('version') + 1, updated_at=timezone.now()
+    )
+    if not updated:
+        DataVersion.objects.get_or_create(name=name)
+        bump(name)
+
+
+def get_user_state(user):
+    """Состояние избранного, корзины и подписок пользователя.
+
+    Меняется при любом добавлении или удалении связи: вместе с числом
+    строк учитывается наибольший id, а он растёт у каждой новой строки.
+    """
+    relations = (
+        (Recipe.favorite.through, 'user'),
+        (Recipe.cart.through, 'user'),
+        (User.subscribe.through, 'from_user'),
+    )
+    annotations = {}
+    for number, (model, field) in enumerate(relations):
+        rows = model.objects.filter(
+            **{field: user.pk}
+        ).order_by().values(field).annotate(
+            count=Count('id'), last=Max('id')
+        )
+        annotations[f'count_{number}'] = Subquery(rows.values('count'))
+        annotations[f'last_{number}'] = Subquery(rows.values('last'))
+    return User.objects.filter(pk=user.pk).annotate(
+        **annotations
+    ).values_list('cart_version', *annotations).first()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def catalog_changed(**kwargs):
+    bump()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipes_changed(**kwargs):
+    bump(RECIPES)
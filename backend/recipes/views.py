@@ -1,49 +1,185 @@
-from datetime import datetime as dt
-
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import F, Sum
-from django.http.response import HttpResponse
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import HTTP_400_BAD_REQUEST
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, ViewSet
+
+from recipes.models import Ingredient, Recipe, RecipeSimilarity, Tag
 
-from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
-from .filters import IngredientFilter, TagAuthorFilter
-from .mixins import AddRemoveMixin
-from .paginators import CustomPageNumberPagination
+from . import (cart, catalog, counters, ingredient_index, metrics, pantry,
+               profiling, timeline, versions)
+from .filters import TagAuthorFilter
+from .mixins import AddRemoveMixin, ConditionalGetMixin
+from .paginators import FeedPagination, RankedPagination, RecipePagination
 from .permissions import AdminOrReadOnly, AuthorOrReadOnly
 from .serializers import (IngredientSerializer, LiteRecipeSerializer,
                           RecipeSerializer, TagSerializer)
+from .shopping_list import RENDERERS, shopping_list_response
 
 User = get_user_model()
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class CatalogViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
+    """Справочник, который отдаётся из каталога в памяти процесса."""
+    catalog_name = None
+
+    def get_validators(self, request):
+        """Версия того снимка каталога, который и будет отдан."""
+        self.catalog = catalog.get()
+        return (
+            (versions.CATALOG, self.catalog.version), self.catalog.updated_at
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.list_cached, request)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(self.retrieve_cached, request, kwargs['pk'])
+
+    def list_cached(self, request):
+        return Response(self.catalog.data[self.catalog_name])
+
+    def retrieve_cached(self, request, pk):
+        items = self.catalog.data_by_id[self.catalog_name]
+        if not str(pk).isdecimal() or int(pk) not in items:
+            raise Http404
+        return Response(items[int(pk)])
+
+
+class TagViewSet(CatalogViewSet):
     """Изменение и создание тэгов."""
+    catalog_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AdminOrReadOnly,)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogViewSet):
     """Изменение и создание ингредиентов."""
+    catalog_name = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AdminOrReadOnly,)
-    filter_backends = (IngredientFilter,)
-    search_fields = ('^name',)
 
+    def list(self, request, *args, **kwargs):
+        """Список ингредиентов; поиск по name идёт по индексу в памяти."""
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return self.conditional(self.search, request, name)
 
-class RecipeViewSet(ModelViewSet, AddRemoveMixin):
+    def search(self, request, name):
+        limit = request.query_params.get('limit', '')
+        if not limit.isdecimal() or int(limit) == 0:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        return Response(
+            ingredient_index.search(name, int(limit), self.catalog)
+        )
+
+
+class RecipeViewSet(ConditionalGetMixin, ModelViewSet, AddRemoveMixin):
     """Изменение и создание рецептов."""
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     extra_serializer = LiteRecipeSerializer
-    pagination_class = CustomPageNumberPagination
+    pagination_class = RecipePagination
     filter_class = TagAuthorFilter
     permission_classes = (AuthorOrReadOnly,)
 
+    write_actions = ('update', 'partial_update', 'destroy')
+
+    def get_queryset(self):
+        if self.action in self.write_actions:
+            return Recipe.objects.defer('search_vector')
+        return Recipe.objects.for_serializer(self.request.user)
+
+    def filter_queryset(self, queryset):
+        """Фильтры списка не применяются к изменению и удалению:
+        рецепт ищется только по id, без аннотаций для фильтров."""
+        if self.action in self.write_actions:
+            return queryset
+        return super().filter_queryset(queryset)
+
+    def get_for_response(self, recipe):
+        """Перечитывает рецепт со всем, что нужно для ответа."""
+        return Recipe.objects.for_serializer(self.request.user).get(
+            pk=recipe.pk
+        )
+
+    def get_validators(self, request):
+        """Версия рецептов в ответе, каталога и, для юзера, его связей.
+
+        Списку Last-Modified не отдаётся: удаление рецепта не меняет
+        время изменения остальных, поэтому список сверяется только
+        по версии рецептов в ETag. Для авторизованных Last-Modified
+        не отдаётся вовсе: изменения избранного, корзины и подписок
+        видны только в ETag.
+        """
+        user = request.user
+        updated_at = None
+        if self.action == 'retrieve':
+            if not str(self.kwargs['pk']).isdecimal():
+                return None
+            updated_at = Recipe.objects.filter(
+                pk=self.kwargs['pk']
+            ).values_list('updated_at', flat=True).first()
+            if updated_at is None:
+                return None
+            version, catalog_updated_at = versions.get()
+            parts = (updated_at, version)
+            if catalog_updated_at is not None:
+                updated_at = max(updated_at, catalog_updated_at)
+        else:
+            parts = versions.get_many(versions.RECIPES, versions.CATALOG)
+        if user.is_anonymous:
+            return parts, updated_at
+        return (*parts, user.pk, versions.get_user_state(user)), None
+
+    def perform_create(self, serializer):
+        serializer.instance = self.get_for_response(serializer.save())
+
+    def perform_update(self, serializer):
+        serializer.instance = self.get_for_response(serializer.save())
+
+    def perform_destroy(self, instance):
+        users = cart.get_cart_users((instance.id,))
+        amounts = cart.get_recipe_amounts((instance.id,))
+        with transaction.atomic():
+            instance.delete()
+            cart.recipe_changed(instance.id, amounts, users)
+            counters.change(
+                User, (instance.author_id,), 'recipes_count', -1
+            )
+
+    def perform_add(self, field, ids):
+        if field == 'shopping_cart' and ids:
+            cart.add_recipes(self.request.user, ids)
+
+    def perform_remove(self, field, ids):
+        if field == 'shopping_cart' and ids:
+            cart.remove_recipes(self.request.user, ids)
+
+    @action(
+        methods=['POST'], detail=False, permission_classes=(IsAuthenticated,)
+    )
+    def bulk(self, request):
+        """Создание нескольких рецептов одной транзакцией."""
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.save()
+        queryset = self.get_queryset().filter(
+            id__in=[recipe.id for recipe in recipes]
+        )
+        return Response(
+            self.get_serializer(queryset, many=True).data,
+            status=HTTP_201_CREATED
+        )
+
     @action(methods=['GET', 'POST', 'DELETE'], detail=True)
     def favorite(self, request, pk):
         """Добавление или удаление рецепта из избранного."""
@@ -54,31 +190,168 @@ class RecipeViewSet(ModelViewSet, AddRemoveMixin):
         """Добавление или удаление рецепта из списка покупок."""
         return self.add_remove_obj(pk, 'shopping_cart')
 
+    @action(methods=['POST', 'DELETE'], detail=False, url_path='favorite')
+    def favorite_batch(self, request):
+        """Добавление или удаление нескольких рецептов из избранного."""
+        return self.add_remove_batch('favorite')
+
+    @action(
+        methods=['POST', 'DELETE'], detail=False, url_path='shopping_cart'
+    )
+    def shopping_cart_batch(self, request):
+        """Добавление или удаление нескольких рецептов из списка покупок."""
+        return self.add_remove_batch('shopping_cart')
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk):
+        """Похожие рецепты, посчитанные compute_similar_recipes.
+
+        Параметр limit ограничивает их число.
+        """
+        if not str(pk).isdecimal():
+            raise Http404
+        limit = request.query_params.get('limit', '')
+        rows = RecipeSimilarity.objects.filter(
+            recipe=pk
+        ).select_related('similar').defer(
+            'similar__search_vector'
+        ).order_by('-score', 'similar_id')
+        if limit.isdecimal():
+            rows = rows[:int(limit)]
+        rows = list(rows)
+        if not rows and not Recipe.objects.filter(pk=pk).exists():
+            raise Http404
+        serializer = self.extra_serializer(
+            [row.similar for row in rows], many=True,
+            context={'request': request}
+        )
+        return Response(serializer.data)
+
+    @action(
+        methods=['GET'], detail=False, permission_classes=(IsAuthenticated,)
+    )
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые первыми, по курсору."""
+        user = request.user
+        queryset = Recipe.objects.for_serializer(user)
+        paginator = FeedPagination()
+        recipes = paginator.paginate_feed(
+            request,
+            lambda pub_date, pk, count: timeline.get_recipes(
+                user, queryset, pub_date, pk, count
+            )
+        )
+        serializer = self.get_serializer(recipes, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def get_pantry_params(self, request):
+        """id ингредиентов из have (повторами или через запятую)
+        и min_coverage."""
+        values = [
+            value.strip()
+            for param in request.query_params.getlist('have')
+            for value in param.split(',') if value.strip()
+        ]
+        if not values or not all(value.isdecimal() for value in values):
+            raise ValidationError(
+                {'have': ['Укажите id ингредиентов через запятую.']}
+            )
+        try:
+            min_coverage = float(request.query_params.get('min_coverage', 0))
+        except ValueError:
+            min_coverage = -1
+        if not 0 <= min_coverage <= 1:
+            raise ValidationError(
+                {'min_coverage': ['Укажите число от 0 до 1.']}
+            )
+        return {int(value) for value in values}, min_coverage
+
     @action(methods=['GET'], detail=False)
+    def pantry(self, request):
+        """Что приготовить: рецепты по доле ингредиентов из have.
+
+        Фильтры списка рецептов (теги, автор, поиск и т. д.) работают
+        и здесь; у каждого рецепта есть matched и missing — число
+        имеющихся и недостающих ингредиентов.
+        """
+        user = request.user
+        have, min_coverage = self.get_pantry_params(request)
+        queryset = self.filter_queryset(Recipe.objects.with_user_flags(user))
+        paginator = RankedPagination()
+        page = paginator.paginate_ranked(
+            request,
+            pantry.get().rank(have, min_coverage),
+            lambda ids: set(queryset.filter(id__in=ids).values_list(
+                'id', flat=True
+            ))
+        )
+        recipes = Recipe.objects.for_serializer(user).in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        page = [item for item in page if item[0] in recipes]
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True
+        )
+        for data, (_, matched, size) in zip(serializer.data, page):
+            data['matched'] = matched
+            data['missing'] = size - matched
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['GET'], detail=False, permission_classes=(IsAuthenticated,)
+    )
     def download_shopping_cart(self, request):
-        """Создание и скачивание списка покупок в формате *.TXT"""
+        """Скачивание списка покупок в формате TXT, CSV или PDF.
+
+        Формат выбирается параметром type, по умолчанию txt.
+        """
         user = self.request.user
-        if not user.carts.exists():
+        renderer = RENDERERS.get(request.query_params.get('type', 'txt'))
+        if renderer is None or not user.carts.exists():
             return Response(status=HTTP_400_BAD_REQUEST)
-        ingredients = IngredientAmount.objects.filter(
-            recipe__in=(user.carts.values('id'))
-        ).values(
-            ingredient=F('ingredients__name'),
-            measure=F('ingredients__measurement_unit')
-        ).annotate(amount=Sum('amount'))
-
-        filename = f'{user.username}_shopping_list.txt'
-        shopping_list = (
-            f'Список покупок от '
-            f'{dt.now().strftime("%d.%m.%Y, %H:%M")}'
-        )
-        for ing in ingredients:
-            shopping_list += (
-                f'\n- {ing["ingredient"]}: {ing["amount"]} {ing["measure"]}'
-            )
+        return shopping_list_response(user, renderer)
+
 
-        response = HttpResponse(
-            shopping_list, content_type='text.txt; charset=utf-8'
+class ProfileViewSet(ViewSet):
+    """Профили запросов, снятые по заголовку X-Profile."""
+    permission_classes = (IsAdminUser,)
+
+    def get_report(self, pk):
+        if not profiling.is_valid_id(pk):
+            raise Http404
+        return profiling.load(pk)
+
+    def list(self, request):
+        fields = ('id', 'created', 'method', 'path', 'user', 'status',
+                  'duration_ms', 'sql_duration_ms')
+        return Response([
+            {field: report[field] for field in fields}
+            for report in map(profiling.load, profiling.list_profiles())
+        ])
+
+    def retrieve(self, request, pk):
+        return Response(self.get_report(pk))
+
+    @action(methods=['GET'], detail=True)
+    def download(self, request, pk):
+        """Профиль в формате pstats (для snakeviz, pstats и т.п.)."""
+        self.get_report(pk)
+        return FileResponse(
+            open(profiling.get_path(pk, 'prof'), 'rb'),
+            as_attachment=True,
+            filename=f'{pk}.prof',
         )
-        response['Content-Disposition'] = f'attachment; filename={filename}'
-        return response
+
+
+def metrics_view(request):
+    """Метрики всех воркеров для Prometheus.
+
+    nginx не проксирует /metrics/, адрес доступен только внутри сети
+    контейнеров, и читать его могут только сотрудники и запросы
+    с заголовком Authorization: Bearer <METRICS_TOKEN>.
+    """
+    if not metrics.is_allowed(request):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4'
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 21:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX user_subscribe_to_from_idx '
+            'ON users_user_subscribe (to_user_id, from_user_id)',
+            'DROP INDEX user_subscribe_to_from_idx',
+        ),
+    ]
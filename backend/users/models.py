@@ -41,6 +41,18 @@ class User(AbstractUser):
         symmetrical=False,
         verbose_name='Подписка',
     )
+    cart_version = models.PositiveIntegerField(
+        default=0,
+        verbose_name='версия списка покупок',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='количество подписчиков',
+    )
 
     class Meta:
         verbose_name = 'пользователь'
@@ -29,6 +29,8 @@ class CustomUserSerializer(UserSerializer):
         user = self.context.get('request').user
         if user.is_anonymous or (user == obj):
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return user.subscribe.filter(id=obj.id).exists()
 
 
@@ -1,12 +1,16 @@
 from django.contrib.auth import get_user_model
+from django.db.models import (Exists, OuterRef, Prefetch,
+                              prefetch_related_objects)
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.status import HTTP_401_UNAUTHORIZED
 
+from recipes import timeline
 from recipes.mixins import AddRemoveMixin
+from recipes.models import Recipe
 from recipes.paginators import CustomPageNumberPagination
-from recipes.serializers import SubscribeSerializer
+from recipes.serializers import SubscribeSerializer, get_recipes_limit
 
 User = get_user_model()
 
@@ -16,11 +20,36 @@ class UserViewSet(DjoserUserViewSet, AddRemoveMixin):
     pagination_class = CustomPageNumberPagination
     extra_serializer = SubscribeSerializer
 
+    def get_queryset(self):
+        """Пользователи с отметкой подписки одним запросом."""
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(is_subscribed=Exists(
+            User.subscribe.through.objects.filter(
+                from_user=user, to_user=OuterRef('pk')
+            )
+        ))
+
+    def perform_add(self, field, ids):
+        if field == 'subscribe':
+            timeline.subscribed(self.request.user, ids)
+
+    def perform_remove(self, field, ids):
+        if field == 'subscribe':
+            timeline.unsubscribed(self.request.user, ids)
+
     @action(methods=['GET', 'POST', 'DELETE'], detail=True)
     def subscribe(self, request, id):
         """Добавляет или удаляет подписку."""
         return self.add_remove_obj(id, 'subscribe')
 
+    @action(methods=['POST', 'DELETE'], detail=False, url_path='subscribe')
+    def subscribe_batch(self, request):
+        """Добавляет или удаляет подписки на нескольких авторов."""
+        return self.add_remove_batch('subscribe')
+
     @action(methods=['GET'], detail=False)
     def subscriptions(self, request):
         """Выводит список подписок пользователя."""
@@ -29,9 +58,22 @@ class UserViewSet(DjoserUserViewSet, AddRemoveMixin):
             return Response(status=HTTP_401_UNAUTHORIZED)
         authors = user.subscribe.all()
         pages = self.paginate_queryset(authors)
+        authors = list(authors) if pages is None else pages
+        recipes = Recipe.objects.defer('search_vector')
+        limit = get_recipes_limit(request)
+        if limit is not None:
+            recipes = recipes.latest_per_author(
+                [author.id for author in authors], limit
+            )
+        prefetch_related_objects(
+            authors,
+            Prefetch('recipes', queryset=recipes, to_attr='latest_recipes')
+        )
         serializer = SubscribeSerializer(
-            pages,
+            authors,
             many=True,
             context={'request': request}
         )
+        if pages is None:
+            return Response(serializer.data)
         return self.get_paginated_response(serializer.data)